@@ -0,0 +1,87 @@
+"""
+Benchmark for inventory-service lock contention between threads.
+
+Runs 1..16 threads doing reserve+release against the memory backend with
+one global lock (a single stripe) and with 64 per-SKU lock stripes, on two
+workloads: "hot" sends 90% of operations to one SKU, "spread" picks
+uniformly from --skus SKUs. Reports reservations/s and the mean lock wait
+from the inventory_lock_wait_seconds histogram. The SQLite backend is
+measured on the same workloads for comparison.
+
+Usage:
+    python benchmarks/bench_inventory_contention.py --seconds 2 --skus 1000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'inventory-service')
+
+
+def lock_wait(histogram, backend):
+    samples = {s.name: s.value for metric in histogram.collect() for s in metric.samples
+               if s.labels.get('backend') == backend and not s.name.endswith('_bucket')}
+    return samples.get('inventory_lock_wait_seconds_sum', 0.0), samples.get('inventory_lock_wait_seconds_count', 0.0)
+
+
+def run(repository, threads, skus, workload, seconds):
+    product_ids = [f'SKU-{i:05d}' for i in range(skus)]
+    deadline = time.perf_counter() + seconds
+    counts = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        done = 0
+        while time.perf_counter() < deadline:
+            if workload == 'hot' and rng.random() < 0.9:
+                product_id = product_ids[0]
+            else:
+                product_id = rng.choice(product_ids)
+            repository.reserve(product_id, 1)
+            repository.release(product_id, 1)
+            done += 1
+        counts.append(done)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--skus', type=int, default=1000)
+    parser.add_argument('--threads', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    sys.path.insert(0, SERVICE_DIR)
+    from repository import create_repository, LOCK_WAIT
+
+    seed = {f'SKU-{i:05d}': {'name': f'Item {i}', 'quantity': 1000000, 'reserved': 0, 'price': 1.0}
+            for i in range(args.skus)}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configs = [('memory, global lock', 'memory', 1), ('memory, 64 stripes', 'memory', 64),
+                   ('sqlite', 'sqlite', None)]
+        for workload in ('hot', 'spread'):
+            print(f"workload: {workload}")
+            for label, kind, stripes in configs:
+                for threads in [int(t) for t in args.threads.split(',')]:
+                    path = os.path.join(tmpdir, f'{workload}-{threads}.db')
+                    repository = create_repository(kind, seed=seed, path=path, stripes=stripes or 64)
+                    before_sum, before_count = lock_wait(LOCK_WAIT, kind)
+                    total = run(repository, threads, args.skus, workload, args.seconds)
+                    wait_sum, wait_count = lock_wait(LOCK_WAIT, kind)
+                    mean_wait = (wait_sum - before_sum) / max(1, wait_count - before_count)
+                    print(f"  {label:<20} {threads:>2} threads: {total / args.seconds:>9,.0f} reservations/s, "
+                          f"lock wait mean {mean_wait * 1e6:,.1f} us")
+
+
+if __name__ == '__main__':
+    main()
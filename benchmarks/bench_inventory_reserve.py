@@ -0,0 +1,83 @@
+"""
+Benchmark for inventory-service reservations across worker processes.
+
+Starts 1..16 processes (like gunicorn workers on one pod) against one
+SQLite-WAL inventory file. Each process reserves and then releases one unit
+of a random SKU in a loop for --seconds. Reports reservations/s per worker
+count and checks that every SKU ends with its initial reservation count.
+The in-process memory backend is measured once as a single-worker baseline;
+it is not shared between processes.
+
+Usage:
+    python benchmarks/bench_inventory_reserve.py --seconds 3 --skus 100
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'inventory-service')
+sys.path.insert(0, SERVICE_DIR)
+
+from repository import create_repository, InsufficientStock  # noqa: E402
+
+
+def seed(skus):
+    return {f'SKU-{i:05d}': {'name': f'Item {i}', 'quantity': 1000000, 'reserved': 0, 'price': 1.0}
+            for i in range(skus)}
+
+
+def run_worker(kind, path, skus, deadline, seed_value, results):
+    repository = create_repository(kind, seed=seed(skus), path=path)
+    rng = random.Random(seed_value)
+    product_ids = list(seed(skus))
+    reservations = 0
+    while time.time() < deadline:
+        product_id = rng.choice(product_ids)
+        try:
+            repository.reserve(product_id, 1)
+        except InsufficientStock:
+            continue
+        repository.release(product_id, 1)
+        reservations += 1
+    results.put(reservations)
+
+
+def measure(kind, path, workers, skus, seconds):
+    # Create the schema and seed rows before the clock starts
+    create_repository(kind, seed=seed(skus), path=path).all()
+    results = multiprocessing.Queue()
+    deadline = time.time() + seconds
+    processes = [multiprocessing.Process(target=run_worker, args=(kind, path, skus, deadline, i, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--skus', type=int, default=100)
+    parser.add_argument('--workers', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        total = measure('memory', None, 1, args.skus, args.seconds)
+        print(f"memory  1 worker : {total / args.seconds:>9,.0f} reservations/s (per-process copy)")
+        for workers in [int(w) for w in args.workers.split(',')]:
+            path = os.path.join(tmpdir, f'inventory-{workers}.db')
+            total = measure('sqlite', path, workers, args.skus, args.seconds)
+            leaked = sum(item['reserved'] for item in create_repository('sqlite', path=path).all().values())
+            print(f"sqlite {workers:>2} workers: {total / args.seconds:>9,.0f} reservations/s"
+                  f"{'' if leaked == 0 else f' - {leaked} units left reserved!'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@ from prometheus_flask_exporter import PrometheusMetrics
 import logging
 import os
 from datetime import datetime
+from repository import (create_repository, ProductNotFound, ProductExists, InsufficientStock,
+                        ReleaseExceedsReserved, QuantityBelowReserved, InvalidQuantity)
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,8 +21,8 @@ VERSION = "1.0.0"
 SERVICE_NAME = "inventory-service"
 PORT = int(os.getenv('PORT', 5007))
 
-# Хранилище инвентаря (в реальности было бы в БД)
-inventory = {
+# Начальные остатки - заносятся в хранилище, если таких товаров там ещё нет
+SEED_INVENTORY = {
     "PROD-001": {"name": "Laptop", "quantity": 50, "reserved": 5, "price": 999.99},
     "PROD-002": {"name": "Mouse", "quantity": 200, "reserved": 10, "price": 29.99},
     "PROD-003": {"name": "Keyboard", "quantity": 150, "reserved": 8, "price": 79.99},
@@ -28,6 +30,18 @@ inventory = {
     "PROD-005": {"name": "Headphones", "quantity": 100, "reserved": 7, "price": 149.99},
 }
 
+# sqlite - один файл на под, общий для всех воркеров gunicorn; memory - своя копия в каждом процессе
+inventory = create_repository(
+    os.getenv('INVENTORY_BACKEND', 'sqlite'),
+    seed=SEED_INVENTORY,
+    path=os.getenv('INVENTORY_DB_PATH', '/tmp/inventory.db'),
+    stripes=int(os.getenv('INVENTORY_LOCK_STRIPES', 64))
+)
+
+
+def _is_positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -73,19 +87,20 @@ def root():
 @app.route('/inventory', methods=['GET'])
 def list_inventory():
     """Получить список всего инвентаря"""
+    items = inventory.all()
     return jsonify({
-        'total_items': len(inventory),
-        'inventory': inventory
+        'total_items': len(items),
+        'inventory': items
     }), 200
 
 
 @app.route('/inventory/<product_id>', methods=['GET'])
 def check_stock(product_id):
     """Проверить наличие товара"""
-    if product_id not in inventory:
+    item = inventory.get(product_id)
+    if item is None:
         return jsonify({'error': 'Product not found'}), 404
     
-    item = inventory[product_id]
     available = item['quantity'] - item['reserved']
     
     return jsonify({
@@ -102,9 +117,6 @@ def check_stock(product_id):
 @app.route('/inventory/<product_id>/reserve', methods=['POST'])
 def reserve_stock(product_id):
     """Зарезервировать товар"""
-    if product_id not in inventory:
-        return jsonify({'error': 'Product not found'}), 404
-    
     try:
         data = request.get_json()
         quantity = data.get('quantity', 1)
@@ -112,20 +124,21 @@ def reserve_stock(product_id):
         
         if not order_id:
             return jsonify({'error': 'order_id is required'}), 400
+        if not _is_positive_int(quantity):
+            return jsonify({'error': 'quantity must be a positive integer'}), 400
         
-        item = inventory[product_id]
-        available = item['quantity'] - item['reserved']
-        
-        if available < quantity:
+        # Проверка остатка и резерв - одна атомарная операция хранилища
+        try:
+            item = inventory.reserve(product_id, quantity)
+        except ProductNotFound:
+            return jsonify({'error': 'Product not found'}), 404
+        except InsufficientStock as e:
             return jsonify({
                 'error': 'Insufficient stock',
-                'available': available,
+                'available': e.available,
                 'requested': quantity
             }), 400
         
-        # Резервируем товар
-        item['reserved'] += quantity
-        
         logger.info(f"Reserved {quantity} units of {product_id} for order {order_id}")
         
         return jsonify({
@@ -144,9 +157,6 @@ def reserve_stock(product_id):
 @app.route('/inventory/<product_id>/release', methods=['POST'])
 def release_stock(product_id):
     """Освободить зарезервированный товар (отмена заказа)"""
-    if product_id not in inventory:
-        return jsonify({'error': 'Product not found'}), 404
-    
     try:
         data = request.get_json()
         quantity = data.get('quantity', 1)
@@ -154,19 +164,20 @@ def release_stock(product_id):
         
         if not order_id:
             return jsonify({'error': 'order_id is required'}), 400
+        if not _is_positive_int(quantity):
+            return jsonify({'error': 'quantity must be a positive integer'}), 400
         
-        item = inventory[product_id]
-        
-        if item['reserved'] < quantity:
+        try:
+            item = inventory.release(product_id, quantity)
+        except ProductNotFound:
+            return jsonify({'error': 'Product not found'}), 404
+        except ReleaseExceedsReserved as e:
             return jsonify({
                 'error': 'Cannot release more than reserved',
-                'reserved': item['reserved'],
+                'reserved': e.reserved,
                 'requested': quantity
             }), 400
         
-        # Освобождаем резерв
-        item['reserved'] -= quantity
-        
         logger.info(f"Released {quantity} units of {product_id} for order {order_id}")
         
         return jsonify({
@@ -185,25 +196,26 @@ def release_stock(product_id):
 @app.route('/inventory/<product_id>', methods=['PUT'])
 def update_stock(product_id):
     """Обновить количество товара на складе"""
-    if product_id not in inventory:
-        return jsonify({'error': 'Product not found'}), 404
-    
     try:
         data = request.get_json()
         
-        item = inventory[product_id]
-        
-        if 'quantity' in data:
-            new_quantity = int(data['quantity'])
-            if new_quantity < item['reserved']:
-                return jsonify({
-                    'error': 'Cannot set quantity below reserved amount',
-                    'reserved': item['reserved']
-                }), 400
-            item['quantity'] = new_quantity
+        try:
+            quantity = int(data['quantity']) if 'quantity' in data else None
+            price = float(data['price']) if 'price' in data else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'quantity must be an integer and price a number'}), 400
         
-        if 'price' in data:
-            item['price'] = float(data['price'])
+        try:
+            item = inventory.update(product_id, quantity=quantity, price=price)
+        except InvalidQuantity as e:
+            return jsonify({'error': str(e)}), 400
+        except ProductNotFound:
+            return jsonify({'error': 'Product not found'}), 404
+        except QuantityBelowReserved as e:
+            return jsonify({
+                'error': 'Cannot set quantity below reserved amount',
+                'reserved': e.reserved
+            }), 400
         
         logger.info(f"Updated stock for {product_id}")
         
@@ -235,22 +247,25 @@ def add_product():
         
         product_id = data['product_id']
         
-        if product_id in inventory:
-            return jsonify({'error': 'Product already exists'}), 400
+        try:
+            quantity = int(data['quantity'])
+            price = float(data['price'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'quantity must be an integer and price a number'}), 400
         
-        inventory[product_id] = {
-            'name': data['name'],
-            'quantity': int(data['quantity']),
-            'reserved': 0,
-            'price': float(data['price'])
-        }
+        try:
+            item = inventory.add(product_id, data['name'], quantity, price)
+        except InvalidQuantity as e:
+            return jsonify({'error': str(e)}), 400
+        except ProductExists:
+            return jsonify({'error': 'Product already exists'}), 400
         
         logger.info(f"Added new product: {product_id}")
         
         return jsonify({
             'message': 'Product added successfully',
             'product_id': product_id,
-            'product': inventory[product_id]
+            'product': item
         }), 201
         
     except Exception as e:
@@ -264,7 +279,7 @@ def low_stock():
     threshold = int(request.args.get('threshold', 20))
     
     low_stock_items = {}
-    for product_id, item in inventory.items():
+    for product_id, item in inventory.all().items():
         available = item['quantity'] - item['reserved']
         if available <= threshold:
             low_stock_items[product_id] = {
@@ -285,12 +300,13 @@ def low_stock():
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Получить статистику по инвентарю"""
-    total_value = sum(item['quantity'] * item['price'] for item in inventory.values())
-    total_items = sum(item['quantity'] for item in inventory.values())
-    total_reserved = sum(item['reserved'] for item in inventory.values())
+    items = inventory.all().values()
+    total_value = sum(item['quantity'] * item['price'] for item in items)
+    total_items = sum(item['quantity'] for item in items)
+    total_reserved = sum(item['reserved'] for item in items)
     
     return jsonify({
-        'total_products': len(inventory),
+        'total_products': len(items),
         'total_items': total_items,
         'total_reserved': total_reserved,
         'total_available': total_items - total_reserved,
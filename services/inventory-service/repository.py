@@ -0,0 +1,321 @@
+"""
+Хранилища инвентаря.
+
+InventoryRepository - интерфейс, через который app.py читает и меняет
+остатки; reserve/release/update атомарны относительно друг друга.
+MemoryInventoryRepository - словарь в памяти процесса: каждый воркер
+gunicorn видит свою копию, подходит для тестов и одного процесса.
+SQLiteInventoryRepository - файл SQLite в режиме WAL: все воркеры пода
+видят одни и те же остатки, а резерв - один условный UPDATE, поэтому
+проверка остатка и изменение не разрываются другим процессом.
+
+Время ожидания блокировки экспортируется гистограммой
+inventory_lock_wait_seconds: для memory - ожидание полосы StripedLock,
+для sqlite - выполнение условного UPDATE вместе с ожиданием блокировки
+записи в БД.
+"""
+import abc
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Histogram
+
+LOCK_WAIT = Histogram(
+    'inventory_lock_wait_seconds',
+    'Time spent waiting for a per-SKU lock before reserve/release/update',
+    ['backend'],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+)
+
+
+class InventoryError(Exception):
+    """Базовая ошибка операции с инвентарём."""
+
+
+class ProductNotFound(InventoryError):
+    pass
+
+
+class ProductExists(InventoryError):
+    pass
+
+
+class InvalidQuantity(InventoryError):
+    def __init__(self, quantity):
+        super().__init__(f'Quantity must be a non-negative integer, got {quantity!r}')
+        self.quantity = quantity
+
+
+class InsufficientStock(InventoryError):
+    def __init__(self, available):
+        super().__init__(f'Only {available} available')
+        self.available = available
+
+
+class ReleaseExceedsReserved(InventoryError):
+    def __init__(self, reserved):
+        super().__init__(f'Only {reserved} reserved')
+        self.reserved = reserved
+
+
+class QuantityBelowReserved(InventoryError):
+    def __init__(self, reserved):
+        super().__init__(f'{reserved} units are reserved')
+        self.reserved = reserved
+
+
+def _check_quantity(quantity):
+    # Проверяем до записи: в SQLite отрицательный остаток иначе всплыл бы как IntegrityError CHECK
+    if quantity is not None and (isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0):
+        raise InvalidQuantity(quantity)
+
+
+class StripedLock:
+    """
+    Блокировки по SKU, разложенные на stripes полос по хешу product_id.
+
+    Операции над разными SKU почти всегда берут разные полосы и не ждут
+    друг друга, а горячий SKU сериализует только свою полосу. stripes=1 -
+    одна общая блокировка.
+    """
+
+    def __init__(self, stripes=64, backend='memory'):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._wait = LOCK_WAIT.labels(backend)
+
+    @contextmanager
+    def hold(self, key):
+        lock = self._locks[hash(key) % len(self._locks)]
+        if lock.acquire(blocking=False):
+            self._wait.observe(0)
+        else:
+            start = time.perf_counter()
+            lock.acquire()
+            self._wait.observe(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+class InventoryRepository(abc.ABC):
+    """Товар - dict {'name', 'quantity', 'reserved', 'price'}; методы возвращают копии."""
+
+    name = 'base'
+
+    @abc.abstractmethod
+    def get(self, product_id):
+        """Товар или None."""
+
+    @abc.abstractmethod
+    def all(self):
+        """{product_id: товар} в порядке добавления."""
+
+    @abc.abstractmethod
+    def add(self, product_id, name, quantity, price):
+        """Новый товар без резерва; ProductExists, если такой уже есть, InvalidQuantity при quantity < 0."""
+
+    @abc.abstractmethod
+    def update(self, product_id, quantity=None, price=None):
+        """Меняет количество и/или цену; количество не может стать меньше резерва."""
+
+    @abc.abstractmethod
+    def reserve(self, product_id, quantity):
+        """Резервирует quantity единиц, если столько доступно; возвращает товар после резерва."""
+
+    @abc.abstractmethod
+    def release(self, product_id, quantity):
+        """Снимает резерв quantity единиц; возвращает товар после снятия."""
+
+
+class MemoryInventoryRepository(InventoryRepository):
+    name = 'memory'
+
+    def __init__(self, seed=None, stripes=64):
+        self._items = {product_id: dict(item) for product_id, item in (seed or {}).items()}
+        self._stripes = StripedLock(stripes)
+        # Только для добавления новых ключей в словарь; остатки меняются под полосой SKU
+        self._add_lock = threading.Lock()
+
+    def get(self, product_id):
+        item = self._items.get(product_id)
+        # dict(item) копируется целиком под GIL - полузаписанного товара не увидеть
+        return dict(item) if item is not None else None
+
+    def all(self):
+        return {product_id: dict(item) for product_id, item in list(self._items.items())}
+
+    def add(self, product_id, name, quantity, price):
+        _check_quantity(quantity)
+        with self._add_lock:
+            if product_id in self._items:
+                raise ProductExists(product_id)
+            item = {'name': name, 'quantity': quantity, 'reserved': 0, 'price': price}
+            self._items[product_id] = item
+            return dict(item)
+
+    def update(self, product_id, quantity=None, price=None):
+        _check_quantity(quantity)
+        item = self._item(product_id)
+        with self._stripes.hold(product_id):
+            if quantity is not None and quantity < item['reserved']:
+                raise QuantityBelowReserved(item['reserved'])
+            if quantity is not None:
+                item['quantity'] = quantity
+            if price is not None:
+                item['price'] = price
+            return dict(item)
+
+    def reserve(self, product_id, quantity):
+        item = self._item(product_id)
+        with self._stripes.hold(product_id):
+            available = item['quantity'] - item['reserved']
+            if available < quantity:
+                raise InsufficientStock(available)
+            item['reserved'] += quantity
+            return dict(item)
+
+    def release(self, product_id, quantity):
+        item = self._item(product_id)
+        with self._stripes.hold(product_id):
+            if item['reserved'] < quantity:
+                raise ReleaseExceedsReserved(item['reserved'])
+            item['reserved'] -= quantity
+            return dict(item)
+
+    def _item(self, product_id):
+        item = self._items.get(product_id)
+        if item is None:
+            raise ProductNotFound(product_id)
+        return item
+
+
+class SQLiteInventoryRepository(InventoryRepository):
+    name = 'sqlite'
+
+    COLUMNS = 'name, quantity, reserved, price'
+
+    def __init__(self, path, seed=None, busy_timeout=5.0):
+        self.path = path
+        self.seed = seed or {}
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._wait = LOCK_WAIT.labels(self.name)
+
+    def get(self, product_id):
+        row = self._connection().execute(
+            f'SELECT {self.COLUMNS} FROM inventory WHERE product_id = ?', (product_id,)
+        ).fetchone()
+        return self._item(row) if row else None
+
+    def all(self):
+        rows = self._connection().execute(
+            f'SELECT product_id, {self.COLUMNS} FROM inventory ORDER BY rowid'
+        ).fetchall()
+        return {row[0]: self._item(row[1:]) for row in rows}
+
+    def add(self, product_id, name, quantity, price):
+        _check_quantity(quantity)
+        try:
+            self._connection().execute(
+                'INSERT INTO inventory (product_id, name, quantity, reserved, price) VALUES (?, ?, ?, 0, ?)',
+                (product_id, name, quantity, price)
+            )
+        except sqlite3.IntegrityError as e:
+            # Дубликат - только нарушение PRIMARY KEY; NOT NULL и CHECK - ошибки данных, не "уже есть"
+            if 'UNIQUE constraint failed: inventory.product_id' in str(e):
+                raise ProductExists(product_id)
+            raise
+        return {'name': name, 'quantity': quantity, 'reserved': 0, 'price': price}
+
+    def update(self, product_id, quantity=None, price=None):
+        _check_quantity(quantity)
+        rows = self._write(
+            f'UPDATE inventory SET quantity = COALESCE(?, quantity), price = COALESCE(?, price) '
+            f'WHERE product_id = ? AND (? IS NULL OR reserved <= ?) RETURNING {self.COLUMNS}',
+            (quantity, price, product_id, quantity, quantity)
+        )
+        if rows:
+            return self._item(rows[0])
+        raise QuantityBelowReserved(self._existing(product_id)['reserved'])
+
+    def reserve(self, product_id, quantity):
+        # Проверка остатка и резерв - одно выражение, SQLite выполняет его под блокировкой записи
+        rows = self._write(
+            f'UPDATE inventory SET reserved = reserved + ? '
+            f'WHERE product_id = ? AND quantity - reserved >= ? RETURNING {self.COLUMNS}',
+            (quantity, product_id, quantity)
+        )
+        if rows:
+            return self._item(rows[0])
+        item = self._existing(product_id)
+        raise InsufficientStock(item['quantity'] - item['reserved'])
+
+    def release(self, product_id, quantity):
+        rows = self._write(
+            f'UPDATE inventory SET reserved = reserved - ? '
+            f'WHERE product_id = ? AND reserved >= ? RETURNING {self.COLUMNS}',
+            (quantity, product_id, quantity)
+        )
+        if rows:
+            return self._item(rows[0])
+        raise ReleaseExceedsReserved(self._existing(product_id)['reserved'])
+
+    def _write(self, statement, params):
+        connection = self._connection()
+        start = time.perf_counter()
+        rows = connection.execute(statement, params).fetchall()
+        self._wait.observe(time.perf_counter() - start)
+        return rows
+
+    def _existing(self, product_id):
+        item = self.get(product_id)
+        if item is None:
+            raise ProductNotFound(product_id)
+        return item
+
+    @staticmethod
+    def _item(row):
+        return {'name': row[0], 'quantity': row[1], 'reserved': row[2], 'price': row[3]}
+
+    def _connection(self):
+        # Соединение на поток; после fork gunicorn-воркера открываем своё
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._init_schema(connection)
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    def _init_schema(self, connection):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS inventory ('
+                'product_id TEXT PRIMARY KEY, name TEXT NOT NULL, '
+                'quantity INTEGER NOT NULL CHECK (quantity >= 0), '
+                'reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved >= 0 AND reserved <= quantity), '
+                'price REAL NOT NULL)'
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO inventory (product_id, name, quantity, reserved, price) VALUES (?, ?, ?, ?, ?)',
+                [(product_id, item['name'], item['quantity'], item['reserved'], item['price'])
+                 for product_id, item in self.seed.items()]
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+
+def create_repository(kind, seed=None, path=None, stripes=64):
+    if kind == 'memory':
+        return MemoryInventoryRepository(seed, stripes)
+    if kind == 'sqlite':
+        return SQLiteInventoryRepository(path, seed)
+    raise ValueError(f'Unknown inventory backend: {kind}')
@@ -0,0 +1,11 @@
+"""
+Хуки gunicorn; файл подхватывается автоматически из рабочего каталога.
+
+Фоновые потоки не переживают fork, поэтому каждый воркер запускает свои
+после загрузки приложения.
+"""
+
+
+def post_worker_init(worker):
+    from app import start_background
+    start_background()
@@ -0,0 +1,211 @@
+"""
+Исходящие HTTP-вызовы order-service.
+
+ServiceClient держит на каждый апстрим свой requests.Session с пулом
+keep-alive соединений, повторяет запросы с джиттером в пределах бюджета
+ретраев и размыкает цепь (circuit breaker), когда апстрим стабильно падает,
+чтобы не ждать таймаутов. Ошибки - наследники requests.RequestException,
+поэтому существующие обработчики `except requests.RequestException` не меняются.
+"""
+import random
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_LATENCY = Histogram(
+    'order_upstream_request_seconds',
+    'Latency of outbound requests per upstream, including retries',
+    ['upstream', 'method', 'outcome'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+UPSTREAM_ERRORS = Counter(
+    'order_upstream_errors_total',
+    'Failed outbound request attempts per upstream',
+    ['upstream', 'reason']
+)
+UPSTREAM_RETRIES = Counter(
+    'order_upstream_retries_total',
+    'Retried outbound requests per upstream',
+    ['upstream']
+)
+BREAKER_STATE = Gauge(
+    'order_upstream_circuit_open',
+    '1 while the circuit breaker for the upstream is open',
+    ['upstream']
+)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES = {502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Апстрим помечен как недоступный, запрос не отправлялся."""
+
+
+class RetryBudget:
+    """
+    Токен-бакет для ретраев: каждый запрос добавляет ratio токена, каждый
+    ретрай забирает один. Ретраи не могут превысить ~ratio от трафика,
+    поэтому при падении апстрима мы не умножаем на него нагрузку.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.capacity = reserve
+        self._tokens = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """closed -> open после N подряд ошибок -> half-open через reset_timeout."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            # half-open: пропускаем один пробный запрос
+            self._trial_in_flight = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def release_trial(self):
+        """Снимает пробный запрос этого потока, если он закончился без record_success/record_failure."""
+        with self._lock:
+            if self._trial_in_flight and self._trial_thread == threading.get_ident():
+                self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self._opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+                self._opened_at = None
+                BREAKER_STATE.labels(self.name).set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            was_trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if was_trial or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logger.warning(f"Circuit for {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                BREAKER_STATE.labels(self.name).set(1)
+
+
+class ServiceClient:
+    def __init__(self, name, base_url, timeout=5, pool_size=20, max_retries=2,
+                 backoff=0.05, retry_budget=None, breaker=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker(name)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        BREAKER_STATE.labels(name).set(0)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def request(self, method, path, retry=None, **kwargs):
+        """
+        retry=None - повторять только идемпотентные методы; для остальных
+        повтор возможен лишь при таймауте соединения (запрос не ушёл).
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method in IDEMPOTENT_METHODS if retry is None else retry
+        url = f"{self.base_url}{path}"
+        start = time.perf_counter()
+        outcome = 'error'
+        self.retry_budget.deposit()
+        try:
+            attempt = 0
+            while True:
+                if not self.breaker.allow():
+                    outcome = 'circuit_open'
+                    UPSTREAM_ERRORS.labels(self.name, 'circuit_open').inc()
+                    raise CircuitOpenError(f'Circuit for {self.name} is open')
+                response, error = None, None
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.ConnectTimeout as e:
+                    self._record_error('connect_timeout')
+                    error, can_retry = e, True
+                except (requests.Timeout, requests.ConnectionError) as e:
+                    self._record_error('timeout' if isinstance(e, requests.Timeout) else 'connection')
+                    error, can_retry = e, idempotent
+                except requests.RequestException as e:
+                    # Битый ответ, редиректы и т.п. - тоже провал пробного запроса
+                    self._record_error('request')
+                    error, can_retry = e, False
+                else:
+                    if response.status_code < 500:
+                        self.breaker.record_success()
+                        outcome = 'success' if response.status_code < 400 else 'client_error'
+                        return response
+                    self._record_error(f'http_{response.status_code}')
+                    can_retry = idempotent and response.status_code in RETRY_STATUSES
+
+                if attempt >= self.max_retries or not can_retry or not self.retry_budget.withdraw():
+                    if error is not None:
+                        raise error
+                    outcome = 'server_error'
+                    return response
+                attempt += 1
+                UPSTREAM_RETRIES.labels(self.name).inc()
+                # Экспоненциальная задержка с полным джиттером
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+        finally:
+            # Ошибка вне requests не должна навсегда занять слот half-open
+            self.breaker.release_trial()
+            UPSTREAM_LATENCY.labels(self.name, method, outcome).observe(time.perf_counter() - start)
+
+    def _record_error(self, reason):
+        UPSTREAM_ERRORS.labels(self.name, reason).inc()
+        self.breaker.record_failure()
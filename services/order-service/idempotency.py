@@ -0,0 +1,208 @@
+"""
+Idempotency-Key для POST-эндпоинтов, создающих записи.
+
+Первый запрос с ключом резервирует его в таблице (state=in_progress), затем
+выполняется обработчик, и его ответ сохраняется вместе с ключом. Повтор с
+тем же ключом и тем же телом получает сохранённый ответ, не трогая ни
+обработчик, ни апстримы; недавние ключи отдаются из LRU в памяти процесса,
+без запроса в БД. Ключи живут ttl секунд, просроченные периодически
+удаляются по ходу запросов.
+
+Коды ответов (как в draft-ietf-httpapi-idempotency-key-header):
+409 - запрос с этим ключом ещё выполняется, 422 - ключ уже использован с
+другим телом. Ответы 5xx и 429 не сохраняются: клиент повторяет с тем же ключом.
+"""
+import datetime
+import functools
+import hashlib
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+from flask import Response, jsonify, make_response, request
+from prometheus_client import Counter
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 128
+REPLAYED_HEADERS = ('Location',)
+
+
+class IdempotencyStore:
+    def __init__(self, db, model, ttl=86400, lease=60, cache_size=10000, cache_ttl=300,
+                 purge_interval=300, registry=None):
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+        self.lease = lease
+        self.cache_size = cache_size
+        self.cache_ttl = min(cache_ttl, ttl)
+        self.purge_interval = purge_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+        kwargs = {'registry': registry} if registry is not None else {}
+        self._requests = Counter(
+            'http_idempotency_requests_total',
+            'Requests carrying an Idempotency-Key by outcome',
+            ['endpoint', 'result'],
+            **kwargs
+        )
+
+    def idempotent(self, scope):
+        """Декоратор view-функции; scope отделяет ключи разных эндпоинтов."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                client_key = request.headers.get('Idempotency-Key')
+                if client_key is None:
+                    return view(*args, **kwargs)
+                if not 0 < len(client_key) <= MAX_KEY_LENGTH:
+                    return jsonify({'error': f'Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters'}), 400
+                return self._handle(scope, f'{scope}:{client_key}', view, args, kwargs)
+            return wrapper
+        return decorator
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _handle(self, scope, key, view, args, kwargs):
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            return self._replay(scope, 'replay_cache', cached, fingerprint)
+
+        self._purge_expired()
+        conflict = self._reserve(key, fingerprint)
+        if conflict is not None:
+            return self._replay(scope, 'replay_db', conflict, fingerprint)
+
+        self._requests.labels(scope, 'new').inc()
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            self._release(key)
+            raise
+        if response.status_code >= 500 or response.status_code == 429:
+            self._release(key)
+            return response
+
+        stored = {
+            'fingerprint': fingerprint,
+            'status_code': response.status_code,
+            'body': response.get_data(as_text=True),
+            'headers': {h: response.headers[h] for h in REPLAYED_HEADERS if h in response.headers},
+        }
+        try:
+            self.db.session.execute(
+                update(self.model)
+                .where(self.model.key == key)
+                .values(state='completed', status_code=stored['status_code'],
+                        response_body=stored['body'], response_headers=json.dumps(stored['headers']))
+            )
+            self.db.session.commit()
+            self._cache_put(key, stored, self.cache_ttl)
+        except Exception as e:
+            # Ответ уже готов - не ломаем его из-за ошибки сохранения ключа
+            self.db.session.rollback()
+            logger.error(f"Failed to store idempotent response for {key}: {e}")
+        return response
+
+    def _reserve(self, key, fingerprint):
+        """None - ключ наш; иначе dict сохранённого ответа или состояния."""
+        now = datetime.datetime.utcnow()
+        for _ in range(2):
+            try:
+                self.db.session.add(self.model(
+                    key=key, fingerprint=fingerprint, state='in_progress',
+                    created_at=now, expires_at=now + datetime.timedelta(seconds=self.ttl)
+                ))
+                self.db.session.commit()
+                return None
+            except IntegrityError:
+                self.db.session.rollback()
+
+            record = self.db.session.get(self.model, key)
+            if record is None:
+                continue
+            lease_expired = (record.state == 'in_progress'
+                             and record.created_at < now - datetime.timedelta(seconds=self.lease))
+            if record.expires_at > now and not lease_expired:
+                if record.state == 'in_progress':
+                    return {'fingerprint': record.fingerprint, 'in_progress': True}
+                stored = {
+                    'fingerprint': record.fingerprint,
+                    'status_code': record.status_code,
+                    'body': record.response_body,
+                    'headers': json.loads(record.response_headers or '{}'),
+                }
+                self._cache_put(key, stored, min(self.cache_ttl, (record.expires_at - now).total_seconds()))
+                return stored
+            # Ключ просрочен или его владелец умер посреди запроса - забираем
+            self.db.session.execute(
+                delete(self.model).where(self.model.key == key, self.model.created_at == record.created_at)
+            )
+            self.db.session.commit()
+        return {'fingerprint': fingerprint, 'in_progress': True}
+
+    def _replay(self, scope, source, stored, fingerprint):
+        if stored['fingerprint'] != fingerprint:
+            self._requests.labels(scope, 'mismatch').inc()
+            return jsonify({'error': 'Idempotency-Key was already used with a different request body'}), 422
+        if stored.get('in_progress'):
+            self._requests.labels(scope, 'conflict').inc()
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409, {'Retry-After': '1'}
+        self._requests.labels(scope, source).inc()
+        headers = dict(stored['headers'], **{'Idempotent-Replayed': 'true'})
+        return Response(stored['body'], status=stored['status_code'], mimetype='application/json', headers=headers)
+
+    def _release(self, key):
+        try:
+            self.db.session.rollback()
+            self.db.session.execute(delete(self.model).where(self.model.key == key))
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Failed to release idempotency key {key}: {e}")
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        try:
+            result = self.db.session.execute(
+                delete(self.model).where(self.model.expires_at < datetime.datetime.utcnow())
+            )
+            self.db.session.commit()
+            if result.rowcount:
+                logger.info(f"Purged {result.rowcount} expired idempotency keys")
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Idempotency key purge failed: {e}")
+
+    def _cache_get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def _cache_put(self, key, stored, ttl):
+        with self._lock:
+            self._cache[key] = (stored, time.monotonic() + ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
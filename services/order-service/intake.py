@@ -0,0 +1,102 @@
+"""
+Асинхронный приём заказов.
+
+POST /api/v1/orders в async-режиме только сохраняет заказ и кладёт его id в
+ограниченную очередь; дальше пул фоновых потоков проводит заказ по стадиям
+(проверка товара, резерв стока, создание платежа). При переполнении
+очереди API отвечает 429, время каждой стадии пишется в гистограмму.
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+STAGE_LATENCY = Histogram(
+    'order_intake_stage_seconds',
+    'Time spent in each async order intake stage',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+QUEUE_DEPTH = Gauge(
+    'order_intake_queue_depth',
+    'Orders waiting for an intake worker'
+)
+INTAKE_OUTCOMES = Counter(
+    'order_intake_total',
+    'Async order intake results',
+    ['outcome']
+)
+
+
+class IntakeQueueFull(Exception):
+    """Очередь приёма заполнена - клиенту нужно повторить позже."""
+
+
+class IntakePipeline:
+    def __init__(self, app, handler, workers=4, queue_size=1000):
+        self.app = app
+        self.handler = handler
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def full(self):
+        return self._queue.full()
+
+    def submit(self, order_id):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(order_id)
+        except queue.Full:
+            INTAKE_OUTCOMES.labels('rejected').inc()
+            raise IntakeQueueFull(f'{self._queue.qsize()} orders already queued')
+        QUEUE_DEPTH.set(self._queue.qsize())
+
+    def join(self):
+        """Ждёт, пока очередь опустеет (для тестов и graceful shutdown)."""
+        self._queue.join()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            STAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+    def record(self, outcome):
+        INTAKE_OUTCOMES.labels(outcome).inc()
+
+    def _ensure_started(self):
+        # Потоки не переживают fork gunicorn-воркера - стартуем их лениво в каждом процессе
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._work, name=f'order-intake-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _work(self):
+        while True:
+            order_id = self._queue.get()
+            QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                with self.app.app_context():
+                    self.handler(order_id)
+            except Exception as e:
+                logger.error(f"Order intake failed for order {order_id}: {e}")
+                INTAKE_OUTCOMES.labels('error').inc()
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,6 @@
+-- Колонки асинхронного приёма заказов: стадия и причина отмены.
+-- db.create_all() создаёт только отсутствующие таблицы и существующую "order"
+-- не меняет, поэтому на уже развёрнутой БД колонки добавляет этот скрипт.
+-- Повторный запуск безопасен; у старых заказов intake_stage остаётся NULL (синхронные).
+ALTER TABLE "order" ADD COLUMN IF NOT EXISTS intake_stage VARCHAR(30);
+ALTER TABLE "order" ADD COLUMN IF NOT EXISTS status_reason VARCHAR(255);
@@ -0,0 +1,4 @@
+-- У многострочного заказа product_id = NULL, товары лежат в order_item.
+-- db.create_all() не снимает NOT NULL с существующей таблицы "order", поэтому
+-- на уже развёрнутой БД это делает скрипт. Повторный запуск безопасен.
+ALTER TABLE "order" ALTER COLUMN product_id DROP NOT NULL;
@@ -0,0 +1,257 @@
+"""
+Transactional outbox для изменений стока.
+
+Заказ и строка outbox пишутся в одной транзакции, поэтому изменение стока
+не теряется, даже если product-service недоступен. Диспетчер забирает
+неотправленные строки пачками, суммирует дельты по товару и отправляет их
+одним PATCH /api/v1/products/stock с Idempotency-Key пачки: повторная
+отправка после сбоя не применит изменения дважды (at-least-once + дедуп
+на стороне product-service).
+
+Если product-service отверг (400/404) суммарную дельту товара, его строки
+перепроверяются поштучно: возвраты снова ждут пачки, списания уходят по
+одному. В failed переходит только строка, отвергнутая сама по себе, и
+on_rejected(rows) в той же транзакции компенсирует её на стороне заказов.
+"""
+import os
+import threading
+import uuid
+import datetime
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import func, or_, select, update
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_LAG = Gauge(
+    'order_stock_outbox_lag_seconds',
+    'Age of the oldest undelivered stock adjustment'
+)
+OUTBOX_PENDING = Gauge(
+    'order_stock_outbox_pending',
+    'Undelivered stock adjustments'
+)
+OUTBOX_DISPATCHED = Counter(
+    'order_stock_outbox_dispatched_total',
+    'Stock adjustments by delivery result',
+    ['result']
+)
+OUTBOX_BATCH = Histogram(
+    'order_stock_outbox_batch_size',
+    'Outbox rows and coalesced products per dispatched batch',
+    ['kind'],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+
+class OutboxDispatcher:
+    def __init__(self, app, db, model, client, batch_size=500, interval=1.0, lease=30.0, on_rejected=None):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.client = client
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.on_rejected = on_rejected
+        self.autostart = True
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запускает диспетчер при старте воркера: строки, оставшиеся с прошлого запуска, досылаются без notify()."""
+        if self.autostart:
+            self._ensure_started()
+
+    def notify(self):
+        """Будит диспетчер после коммита новой строки outbox."""
+        if self.autostart:
+            self._ensure_started()
+            self._wakeup.set()
+
+    def dispatch_pending(self):
+        """Один проход: дослать зависшие пачки, затем новые. Возвращает число доставленных строк."""
+        delivered = 0
+        for batch_key in self._stale_batches():
+            delivered += self._send(batch_key)
+        while True:
+            batch_key = self._claim()
+            if batch_key is None:
+                break
+            sent = self._send(batch_key)
+            delivered += sent
+            if not sent:
+                break
+        self._update_lag()
+        return delivered
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, name='stock-outbox', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.dispatch_pending()
+            except Exception as e:
+                logger.error(f"Stock outbox dispatch failed: {e}")
+
+    def _claim(self):
+        """Помечает пачку неотправленных строк своим ключом."""
+        model = self.model
+        session = self.db.session
+        ids = session.execute(
+            select(model.id)
+            .where(model.status == 'pending', model.batch_key.is_(None))
+            .order_by(model.id)
+            .limit(self.batch_size)
+        ).scalars().all()
+        if not ids:
+            return None
+        batch_key = f'stock-outbox-{uuid.uuid4()}'
+        # batch_key IS NULL в условии - параллельный диспетчер не заберёт те же строки
+        session.execute(
+            update(model)
+            .where(model.id.in_(ids), model.batch_key.is_(None))
+            .values(batch_key=batch_key, claimed_at=datetime.datetime.utcnow())
+        )
+        session.commit()
+        return batch_key
+
+    def _stale_batches(self):
+        """
+        Пачки, которые кто-то забрал, но не доставил за lease секунд, и пачки
+        без claimed_at: их ключ задал тот, кто писал строку (повтор запроса
+        с уже отправленным Idempotency-Key), - их шлём в первом же проходе.
+        """
+        model = self.model
+        session = self.db.session
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease)
+        stale = session.execute(
+            select(model.batch_key, func.max(model.claimed_at))
+            .where(model.status == 'pending', model.batch_key.isnot(None))
+            .group_by(model.batch_key)
+            .having(or_(func.max(model.claimed_at) < cutoff, func.max(model.claimed_at).is_(None)))
+        ).all()
+        reclaimed = []
+        for batch_key, claimed_at in stale:
+            result = session.execute(
+                update(model)
+                .where(model.batch_key == batch_key, model.claimed_at == claimed_at)
+                .values(claimed_at=datetime.datetime.utcnow())
+            )
+            session.commit()
+            if result.rowcount:
+                reclaimed.append(batch_key)
+        return reclaimed
+
+    def _send(self, batch_key):
+        model = self.model
+        session = self.db.session
+        rows = session.execute(
+            select(model).where(model.batch_key == batch_key, model.status == 'pending')
+        ).scalars().all()
+        if not rows:
+            return 0
+
+        split = []
+        delivered = 0
+        while rows:
+            deltas = {}
+            for row in rows:
+                deltas[row.product_id] = deltas.get(row.product_id, 0) + row.quantity
+            items = [{'product_id': pid, 'quantity': q} for pid, q in sorted(deltas.items()) if q]
+            if not items:
+                delivered += self._mark(rows, 'sent')
+                break
+
+            try:
+                # Ключ пачки делает PATCH идемпотентным, поэтому ретраи разрешены
+                response = self.client.patch(
+                    '/api/v1/products/stock',
+                    json={'items': items},
+                    headers={'Idempotency-Key': batch_key},
+                    retry=True
+                )
+            except Exception as e:
+                logger.warning(f"Stock outbox batch {batch_key} not delivered: {e}")
+                OUTBOX_DISPATCHED.labels('retry').inc(len(rows))
+                break
+
+            if response.status_code == 200:
+                OUTBOX_BATCH.labels('rows').observe(len(rows))
+                OUTBOX_BATCH.labels('products').observe(len(items))
+                delivered += self._mark(rows, 'sent')
+                break
+
+            failed_product = None
+            if response.status_code in (400, 404):
+                failed_product = (response.json() or {}).get('product_id')
+            if failed_product is None:
+                logger.warning(f"Stock outbox batch {batch_key} rejected with {response.status_code}")
+                OUTBOX_DISPATCHED.labels('retry').inc(len(rows))
+                break
+
+            # Батч на стороне product-service всё-или-ничего: откладываем
+            # строки проблемного товара и досылаем остальное тем же ключом
+            product_rows = [row for row in rows if row.product_id == failed_product]
+            rows = [row for row in rows if row.product_id != failed_product]
+            if len(product_rows) == 1:
+                logger.error(f"Stock adjustment for product {failed_product} rejected "
+                             f"({response.status_code}), outbox row {product_rows[0].id} moved to failed")
+                if self.on_rejected:
+                    self.on_rejected(product_rows)
+                self._mark(product_rows, 'failed')
+            else:
+                split.extend(self._split(batch_key, product_rows))
+
+        # Отвергнута сумма по товару - какую из строк product-service не примет, видно только поштучно
+        for key in split:
+            delivered += self._send(key)
+        return delivered
+
+    def _split(self, batch_key, rows):
+        """
+        Раскладывает строки отвергнутого товара: возвраты (quantity > 0) снова
+        ждут обычной пачки, а каждое списание уходит отдельной пачкой со своим
+        ключом, чтобы в failed попали только строки, которые не проходят сами.
+        """
+        decrements = [row for row in rows if row.quantity < 0]
+        # Отказ по одним возвратам (товар удалён) - тоже поштучно, иначе они крутились бы по кругу
+        singles = decrements or rows
+        for row in rows:
+            if row in singles:
+                row.batch_key = f'{batch_key}-{row.id}'
+                row.claimed_at = datetime.datetime.utcnow()
+            else:
+                row.batch_key = None
+                row.claimed_at = None
+        self.db.session.commit()
+        logger.warning(f"Stock outbox batch {batch_key}: product {rows[0].product_id} rejected, "
+                       f"resending {len(singles)} rows one by one, {len(rows) - len(singles)} returns requeued")
+        return [row.batch_key for row in singles]
+
+    def _mark(self, rows, status):
+        now = datetime.datetime.utcnow()
+        for row in rows:
+            row.status = status
+            row.dispatched_at = now
+        self.db.session.commit()
+        OUTBOX_DISPATCHED.labels(status).inc(len(rows))
+        return len(rows) if status == 'sent' else 0
+
+    def _update_lag(self):
+        model = self.model
+        oldest, pending = self.db.session.execute(
+            select(func.min(model.created_at), func.count()).where(model.status == 'pending')
+        ).one()
+        OUTBOX_PENDING.set(pending)
+        OUTBOX_LAG.set((datetime.datetime.utcnow() - oldest).total_seconds() if oldest else 0)
@@ -0,0 +1,70 @@
+"""
+Кеш результатов GET /api/v1/orders/summary.
+
+Агрегаты дорогие, а дашборды повторяют одни и те же запросы, поэтому
+результат живёт в небольшом LRU с TTL внутри процесса. Каждая запись
+привязана к scope - user_id фильтра или None для сводок по всем
+пользователям. Коммит, меняющий заказы пользователя, сбрасывает его scope и
+все общие сводки; TTL ограничивает устаревание в соседних процессах.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+
+class SummaryCache:
+    """LRU + TTL кеш готовых сводок с инвалидацией по пользователю."""
+
+    def __init__(self, max_size=256, ttl=30, registry=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        kwargs = {'registry': registry} if registry is not None else {}
+        self._requests = Counter(
+            'order_summary_cache_requests_total',
+            'Order summary cache lookups',
+            ['result'],
+            **kwargs
+        )
+
+    def get(self, key, scope, compute):
+        """Сводка из кеша или compute(); scope - user_id фильтра или None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(key)
+                self._requests.labels('hit').inc()
+                return entry[0]
+            generation = self._generation
+        self._requests.labels('miss').inc()
+
+        result = compute()
+        with self._lock:
+            # За время расчёта заказы могли измениться - такой результат не кешируем
+            if generation == self._generation:
+                self._data[key] = (result, time.monotonic() + self.ttl, scope)
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+        return result
+
+    def invalidate(self, user_ids):
+        """Сбрасывает сводки этих пользователей и все сводки без фильтра по пользователю."""
+        user_ids = set(user_ids)
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, (_, _, scope) in self._data.items()
+                     if scope is None or scope in user_ids]
+            for key in stale:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
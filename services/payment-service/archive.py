@@ -0,0 +1,403 @@
+"""
+Холодный архив старых записей в сжатых append-only сегментах на диске.
+
+Сегмент - файл <name>-<seq>.seg из независимо сжатых (zlib) блоков NDJSON
+по block_rows записей, отсортированных по sort_key, и файл <name>-<seq>.idx
+с разреженным индексом: для каждого блока смещение, min/max индексируемых
+полей и bloom-фильтр по lookup_keys. Поиск читает с диска и распаковывает
+только блоки, прошедшие zone map и bloom-фильтр; недавно прочитанные блоки
+держатся в небольшом LRU.
+
+Сегменты неизменяемы: запись идёт во временный файл, затем fsync и rename,
+и .idx появляется последним - читатели видят только целые сегменты.
+Пока заархивированные строки не удалены из БД, рядом лежит маркер
+<name>-<seq>.pending: если прогон упал между записью и удалением,
+следующий прогон сначала дочищает БД по нему, не записывая строки повторно.
+ARCHIVE_DIR обязателен для архивации и должен быть общим постоянным томом
+(PVC ReadWriteMany): каждая реплика читает сегменты, записанные любой другой,
+и архив переживает рестарт пода. Без него архив пуст, а архивация отклоняется.
+
+Запуск из командной строки (например, из CronJob):
+    python archive.py [older_than_days]
+"""
+import base64
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+BLOOM_BITS_PER_KEY = 12
+BLOOM_HASHES = 7
+
+
+class BloomFilter:
+    def __init__(self, size_bits, bits=None):
+        self.size = max(64, size_bits)
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    @staticmethod
+    def hashes(value):
+        # Один хеш на значение - позиции для фильтров разного размера считаются из него
+        digest = hashlib.blake2b(str(value).encode(), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def _positions(self, hashes):
+        h1, h2 = hashes
+        return ((h1 + i * h2) % self.size for i in range(BLOOM_HASHES))
+
+    def add(self, value):
+        for position in self._positions(self.hashes(value)):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, hashes):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(hashes))
+
+    def dump(self):
+        return {'size': self.size, 'bits': base64.b64encode(bytes(self.bits)).decode()}
+
+    @classmethod
+    def load(cls, data):
+        return cls(data['size'], bytearray(base64.b64decode(data['bits'])))
+
+
+class ArchiveBusy(Exception):
+    """Архивация уже идёт в другом процессе."""
+
+
+class ArchiveNotConfigured(Exception):
+    """Каталог архива не задан - переносить строки из БД некуда."""
+
+
+class Archive:
+    def __init__(self, directory, name, sort_key, lookup_keys, block_rows=1000, cache_blocks=64):
+        self.directory = directory
+        self.name = name
+        self.sort_key = sort_key
+        self.lookup_keys = tuple(lookup_keys)
+        self.zone_keys = tuple(dict.fromkeys((sort_key, 'created_at') + self.lookup_keys))
+        self.block_rows = block_rows
+        self.cache_blocks = cache_blocks
+        self._segments = []
+        self._seen = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- запись -------------------------------------------------------------
+
+    def run_lock(self):
+        """Эксклюзивная блокировка прогона архивации между процессами; занята - ArchiveBusy."""
+        self._require_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, f'.{self.name}.run.lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise ArchiveBusy(f'{self.name} archival is already running')
+        return lock
+
+    def write_segment(self, records, pending=False):
+        """
+        Пишет новый сегмент из records, отсортированных по sort_key.
+
+        Возвращает мета сегмента или None, если записей нет. С pending=True
+        сегмент помечается как ещё не удалённый из БД до вызова complete(seq).
+        """
+        self._require_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f'.{self.name}.lock'), 'w') as lock:
+            # Номер сегмента и rename - под межпроцессной блокировкой
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            seq = max((s['seq'] for s in self._scan()), default=0) + 1
+            base = self._base(seq)
+            tmp_path = base + '.seg.tmp'
+            blocks = []
+            rows = 0
+            with open(tmp_path, 'wb') as out:
+                block = []
+                for record in records:
+                    block.append(record)
+                    if len(block) >= self.block_rows:
+                        blocks.append(self._write_block(out, block))
+                        rows += len(block)
+                        block = []
+                if block:
+                    blocks.append(self._write_block(out, block))
+                    rows += len(block)
+                out.flush()
+                os.fsync(out.fileno())
+            if not rows:
+                os.remove(tmp_path)
+                return None
+
+            meta = {'seq': seq, 'rows': rows, 'sort_key': self.sort_key, 'blocks': blocks,
+                    'created_at': datetime.datetime.utcnow().isoformat()}
+            os.rename(tmp_path, base + '.seg')
+            if pending:
+                open(base + '.pending', 'w').close()
+            with open(base + '.idx.tmp', 'w') as out:
+                json.dump(meta, out)
+                out.flush()
+                os.fsync(out.fileno())
+            os.rename(base + '.idx.tmp', base + '.idx')
+            self._fsync_directory()
+        logger.info(f"Archive segment {self.name}-{seq:08d} written: {rows} rows in {len(blocks)} blocks")
+        return meta
+
+    def pending_segments(self):
+        return [entry['seq'] for entry in self._scan() if os.path.exists(self._base(entry['seq']) + '.pending')]
+
+    def segment_ids(self, seq):
+        """id всех записей сегмента - для дочистки БД после прерванного прогона."""
+        segment = next(s for s in self._current_segments() if s['seq'] == seq)
+        return [json.loads(line)['id'] for block in segment['blocks']
+                for line in self._read_block(segment, block).splitlines()]
+
+    def complete(self, seq):
+        os.remove(self._base(seq) + '.pending')
+
+    def _require_directory(self):
+        if not self.directory:
+            raise ArchiveNotConfigured('ARCHIVE_DIR is not set')
+
+    def _base(self, seq):
+        return os.path.join(self.directory, f'{self.name}-{seq:08d}')
+
+    def _write_block(self, out, records):
+        payload = zlib.compress(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode(), 6)
+        offset = out.tell()
+        out.write(payload)
+        block = {'offset': offset, 'length': len(payload), 'rows': len(records), 'min': {}, 'max': {}, 'bloom': {}}
+        for key in self.zone_keys:
+            values = [r[key] for r in records if r.get(key) is not None]
+            if values:
+                block['min'][key] = min(values)
+                block['max'][key] = max(values)
+        for key in self.lookup_keys:
+            bloom = BloomFilter(len(records) * BLOOM_BITS_PER_KEY)
+            for record in records:
+                bloom.add(record[key])
+            block['bloom'][key] = bloom.dump()
+        return block
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # --- чтение -------------------------------------------------------------
+
+    def find(self, field, value):
+        """Все записи архива с record[field] == value."""
+        return self.find_many(field, [value]).get(value, [])
+
+    def find_many(self, field, values):
+        """{value: [записи]} для найденных значений; каждый блок читается не больше одного раза."""
+        wanted = sorted(set(values))
+        found = {}
+        if not wanted:
+            return found
+        hashes = {value: BloomFilter.hashes(value) for value in wanted}
+        for segment in self._current_segments():
+            for block in segment['blocks']:
+                block_min = block['min'].get(field)
+                if block_min is None:
+                    continue
+                block_max = block['max'][field]
+                if block_max < wanted[0] or block_min > wanted[-1]:
+                    continue
+                candidates = [v for v in wanted if block_min <= v <= block_max]
+                bloom = block['filters'].get(field)
+                if bloom is not None:
+                    candidates = [v for v in candidates if bloom.might_contain(hashes[v])]
+                if not candidates:
+                    continue
+                text = self._read_block(segment, block)
+                for value in candidates:
+                    for record in self._matching(text, field, value):
+                        found.setdefault(value, []).append(record)
+        return found
+
+    def stats(self):
+        segments = self._current_segments()
+        return {
+            'segments': len(segments),
+            'rows': sum(s['rows'] for s in segments),
+            'bytes': sum(os.path.getsize(s['path']) + os.path.getsize(s['path'][:-len('.seg')] + '.idx')
+                         for s in segments),
+        }
+
+    @staticmethod
+    def _matching(text, field, value):
+        # Разбираем JSON только у строк, где встречается "field":value, а не весь блок
+        needle = f'"{field}":{json.dumps(value)}'
+        position = text.find(needle)
+        while position >= 0:
+            end = position + len(needle)
+            if text[end] in ',}':
+                line_start = text.rfind('\n', 0, position) + 1
+                record = json.loads(text[line_start:text.index('\n', end)])
+                if record.get(field) == value:
+                    yield record
+            position = text.find(needle, end)
+
+    def _read_block(self, segment, block):
+        key = (segment['path'], block['offset'])
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        with open(segment['path'], 'rb') as source:
+            source.seek(block['offset'])
+            payload = source.read(block['length'])
+        text = zlib.decompress(payload).decode()
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return text
+
+    def _current_segments(self):
+        # Сегменты дописывают другие процессы: перечитываем индекс, когда меняется каталог
+        if not self.directory:
+            return []
+        try:
+            seen = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if seen == self._seen:
+                return self._segments
+        segments = []
+        for entry in self._scan():
+            with open(entry['idx']) as source:
+                meta = json.load(source)
+            for block in meta['blocks']:
+                block['filters'] = {k: BloomFilter.load(v) for k, v in block['bloom'].items()}
+            meta['path'] = entry['seg']
+            segments.append(meta)
+        with self._lock:
+            self._segments, self._seen = segments, seen
+        return segments
+
+    def _scan(self):
+        if not self.directory:
+            return []
+        pattern = re.compile(rf'^{re.escape(self.name)}-(\d+)\.idx$')
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for file_name in names:
+            match = pattern.match(file_name)
+            if match:
+                base = os.path.join(self.directory, file_name[:-len('.idx')])
+                entries.append({'seq': int(match.group(1)), 'idx': base + '.idx', 'seg': base + '.seg'})
+        return sorted(entries, key=lambda e: e['seq'])
+
+
+def _delete_committed(session, ids, delete_rows, chunk_size):
+    for offset in range(0, len(ids), chunk_size):
+        delete_rows(ids[offset:offset + chunk_size])
+        session.commit()
+
+
+def archive_rows(session, model, archive, where, to_record, delete_rows, limit, chunk_size=1000):
+    """
+    Переносит до limit строк model, подходящих под where, в новый сегмент archive.
+
+    Строки читаются потоком в порядке sort_key, пишутся в сегмент и затем
+    удаляются из БД чанками: delete_rows(ids) без коммита, коммит - здесь.
+    Одновременно идёт только один прогон на архив (иначе ArchiveBusy).
+    """
+    start = time.perf_counter()
+    with archive.run_lock():
+        recovered = 0
+        for seq in archive.pending_segments():
+            ids = archive.segment_ids(seq)
+            _delete_committed(session, ids, delete_rows, chunk_size)
+            archive.complete(seq)
+            recovered += len(ids)
+            logger.warning(f"Archive segment {archive.name}-{seq:08d}: deleted {len(ids)} rows left by an interrupted run")
+
+        sort_column = getattr(model, archive.sort_key)
+        rows = session.execute(
+            select(model).where(*where)
+            .order_by(sort_column, model.created_at, model.id)
+            .limit(limit)
+            .execution_options(yield_per=chunk_size)
+        ).scalars()
+        ids = []
+
+        def records():
+            for row in rows:
+                ids.append(row.id)
+                yield to_record(row)
+
+        meta = archive.write_segment(records(), pending=True)
+        session.commit()
+        if meta:
+            _delete_committed(session, ids, delete_rows, chunk_size)
+            archive.complete(meta['seq'])
+
+    elapsed = time.perf_counter() - start
+    return {
+        'archived': len(ids),
+        'recovered': recovered,
+        'segment': meta['seq'] if meta else None,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(len(ids) / elapsed) if elapsed else 0,
+    }
+
+
+def merge_history(live, archived, limit):
+    """Сливает страницы из БД и архива по (created_at, id) по убыванию, без дублей."""
+    merged = {record['id']: record for record in archived}
+    merged.update((record['id'], record) for record in live)
+    ordered = sorted(merged.values(), key=lambda r: (r['created_at'], r['id']), reverse=True)
+    return ordered[:limit]
+
+
+def archived_history(archive, user_id, statuses, since, until, cursor):
+    """Записи пользователя из архива, отфильтрованные как история в БД."""
+    records = []
+    for record in archive.find('user_id', user_id):
+        created_at = datetime.datetime.fromisoformat(record['created_at'])
+        if statuses and record['status'] not in statuses:
+            continue
+        if since and created_at < since:
+            continue
+        if until and created_at >= until:
+            continue
+        if cursor and (created_at, record['id']) >= cursor:
+            continue
+        records.append(record)
+    return records
+
+
+def main():
+    from app import app, archive_settled, ARCHIVE_AFTER_DAYS
+    logging.getLogger().setLevel(logging.WARNING)
+    older_than_days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    with app.app_context():
+        sys.stdout.write(json.dumps(archive_settled(older_than_days)) + '\n')
+
+
+if __name__ == '__main__':
+    main()
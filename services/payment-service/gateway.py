@@ -0,0 +1,49 @@
+"""
+Платёжные шлюзы.
+
+PaymentGateway - интерфейс, через который процессор проводит платёж.
+StubGateway - локальная заглушка вместо настоящего провайдера: задержка и
+доля отказов настраиваются, чтобы нагрузочные тесты видели реалистичное
+время ответа шлюза.
+"""
+import abc
+import random
+import time
+import uuid
+from collections import namedtuple
+
+GatewayResult = namedtuple('GatewayResult', ['success', 'transaction_id', 'error'])
+
+
+class PaymentGateway(abc.ABC):
+    """Провайдер платежей; реализации должны быть потокобезопасными."""
+
+    name = 'base'
+
+    @abc.abstractmethod
+    def charge(self, payment):
+        """payment - dict из Payment.to_dict(); возвращает GatewayResult."""
+
+
+class StubGateway(PaymentGateway):
+    name = 'stub'
+
+    def __init__(self, latency_ms=0, jitter_ms=0, failure_rate=0.25, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def charge(self, payment):
+        delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self._random.random() < self.failure_rate:
+            return GatewayResult(False, None, 'Declined by gateway')
+        return GatewayResult(True, f"TXN-{uuid.uuid4().hex[:12].upper()}", None)
+
+
+def create_gateway(kind, **options):
+    if kind == 'stub':
+        return StubGateway(**options)
+    raise ValueError(f'Unknown payment gateway: {kind}')
@@ -0,0 +1,5 @@
+-- Индекс (user_id, created_at) для истории платежей пользователя.
+-- db.create_all() не создаёт индексы на уже существующей таблице payment, поэтому
+-- на развёрнутой БД его добавляет этот скрипт. CONCURRENTLY не блокирует запись;
+-- если построение прервалось, удалите невалидный индекс (DROP INDEX) и запустите снова.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payment_user_id_created_at ON payment (user_id, created_at);
@@ -0,0 +1,5 @@
+-- Индекс по payment.order_id для поиска платежей заказа.
+-- db.create_all() не создаёт индексы на уже существующей таблице payment, поэтому
+-- на развёрнутой БД его добавляет этот скрипт. CONCURRENTLY не блокирует запись;
+-- если построение прервалось, удалите невалидный индекс (DROP INDEX) и запустите снова.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payment_order_id ON payment (order_id);
@@ -0,0 +1,78 @@
+"""
+Кеш платежей по order_id для страниц со списками заказов.
+
+В кеш попадают только платежи в конечных статусах (completed, failed,
+refunded). Из них только completed ещё может смениться на refunded, и
+refund явно сбрасывает запись. Pending/processing всегда читаются из БД.
+Короткий TTL ограничивает устаревание в соседних процессах.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+CACHEABLE_STATUSES = ('completed', 'failed', 'refunded')
+
+
+class PaymentCache:
+    """LRU + TTL кеш словарей платежей по order_id."""
+
+    def __init__(self, max_size=20000, ttl=10, registry=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        kwargs = {'registry': registry} if registry is not None else {}
+        self._requests = Counter(
+            'payment_lookup_cache_requests_total',
+            'Payment-by-order cache lookups',
+            ['result'],
+            **kwargs
+        )
+
+    def get_many(self, order_ids, loader):
+        """
+        Возвращает {order_id: платёж} для найденных заказов.
+
+        loader(missing_ids) -> {order_id: платёж} вызывается один раз на все промахи.
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for order_id in order_ids:
+                entry = self._data.get(order_id)
+                if entry is not None and entry[1] > now:
+                    self._data.move_to_end(order_id)
+                    found[order_id] = entry[0]
+                    continue
+                if entry is not None:
+                    del self._data[order_id]
+                missing.append(order_id)
+        if found:
+            self._requests.labels('hit').inc(len(found))
+        if not missing:
+            return found
+
+        self._requests.labels('miss').inc(len(missing))
+        loaded = loader(missing)
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for order_id, payment in loaded.items():
+                if payment['status'] in CACHEABLE_STATUSES:
+                    self._data[order_id] = (payment, expires_at)
+                    self._data.move_to_end(order_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    def invalidate(self, order_id):
+        with self._lock:
+            self._data.pop(order_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,219 @@
+"""
+Проведение платежей через шлюз.
+
+Платёж сначала атомарно переводится pending -> processing (повторная или
+параллельная обработка его не заберёт), затем шлюз вызывается вне
+транзакции БД, и результат записывается как completed/failed. Асинхронные
+платежи обрабатывает ограниченный пул фоновых потоков; при заполненной
+очереди submit бросает ProcessorQueueFull.
+
+Очередь живёт в памяти процесса: после рестарта или падения воркера его
+платежи остались бы в processing навсегда. Поэтому при старте и затем
+каждые resume_interval секунд resume() забирает платежи, которые лежат в
+processing дольше resume_after секунд, и ставит их в очередь заново.
+"""
+import os
+import queue
+import threading
+import time
+import datetime
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import select, update
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = Gauge(
+    'payment_processor_queue_depth',
+    'Payments waiting for a processor worker'
+)
+SETTLEMENT_LATENCY = Histogram(
+    'payment_settlement_seconds',
+    'Gateway settlement latency per payment',
+    ['gateway', 'outcome'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+SETTLEMENTS = Counter(
+    'payment_settlement_total',
+    'Settled payments by outcome',
+    ['outcome']
+)
+
+
+class ProcessorQueueFull(Exception):
+    """Очередь процессора заполнена - клиенту нужно повторить позже."""
+
+
+class PaymentProcessor:
+    def __init__(self, app, db, model, gateway, workers=8, queue_size=1000, resume_after=300.0,
+                 resume_interval=60.0):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.gateway = gateway
+        self.workers = workers
+        self.resume_after = resume_after
+        self.resume_interval = resume_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def claim(self, payment_ids):
+        """Переводит pending -> processing одним UPDATE; возвращает забранные payment_id."""
+        model = self.model
+        rows = self.db.session.execute(
+            update(model)
+            .where(model.payment_id.in_(payment_ids), model.status == 'pending')
+            .values(status='processing', updated_at=datetime.datetime.utcnow())
+            .returning(model.payment_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        self.db.session.commit()
+        return set(rows)
+
+    def unclaim(self, payment_ids):
+        """Возвращает в pending платежи, которые не удалось поставить в очередь."""
+        model = self.model
+        self.db.session.execute(
+            update(model)
+            .where(model.payment_id.in_(payment_ids), model.status == 'processing')
+            .values(status='pending')
+            .execution_options(synchronize_session=False)
+        )
+        self.db.session.commit()
+
+    def resume(self):
+        """
+        Ставит в очередь платежи, застрявшие в processing дольше resume_after.
+
+        Платёж перезабирается условным UPDATE (обновляется updated_at), поэтому
+        из нескольких воркеров и подов его возьмёт только один. Платёж, который
+        не влез в очередь, останется в processing до следующего прохода.
+        """
+        model = self.model
+        session = self.db.session
+        capacity = self._queue.maxsize - self._queue.qsize()
+        if capacity <= 0:
+            return 0
+        now = datetime.datetime.utcnow()
+        cutoff = now - datetime.timedelta(seconds=self.resume_after)
+        stuck = session.execute(
+            select(model.payment_id)
+            .where(model.status == 'processing', model.updated_at < cutoff)
+            .order_by(model.id)
+            .limit(capacity)
+        ).scalars().all()
+        if not stuck:
+            return 0
+        reclaimed = session.execute(
+            update(model)
+            .where(model.payment_id.in_(stuck), model.status == 'processing', model.updated_at < cutoff)
+            .values(updated_at=now)
+            .returning(model.payment_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        session.commit()
+        resumed = 0
+        for payment_id in reclaimed:
+            try:
+                self.submit(payment_id)
+            except ProcessorQueueFull:
+                break
+            resumed += 1
+        if reclaimed:
+            logger.warning(f"Resumed {resumed} of {len(reclaimed)} payments stuck in processing")
+        return resumed
+
+    def start(self):
+        """Запуск при старте воркера: потоки и досылка застрявших платежей."""
+        self._ensure_started()
+        try:
+            with self.app.app_context():
+                self.resume()
+        except Exception as e:
+            # Недоступная БД не должна ронять воркер - досылку повторит _resume_loop
+            logger.error(f"Resuming stuck payments failed: {e}")
+
+    def submit(self, payment_id):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(payment_id)
+        except queue.Full:
+            SETTLEMENTS.labels('rejected').inc()
+            raise ProcessorQueueFull(f'{self._queue.qsize()} payments already queued')
+        QUEUE_DEPTH.set(self._queue.qsize())
+
+    def join(self):
+        """Ждёт, пока очередь опустеет (для тестов и graceful shutdown)."""
+        self._queue.join()
+
+    def settle(self, payment_id):
+        """Проводит уже забранный (processing) платёж через шлюз и сохраняет результат."""
+        model = self.model
+        session = self.db.session
+        payment = session.execute(
+            select(model).where(model.payment_id == payment_id)
+        ).scalar_one()
+        data = payment.to_dict()
+        # Соединение с БД не держим, пока ждём шлюз
+        session.commit()
+
+        start = time.perf_counter()
+        try:
+            result = self.gateway.charge(data)
+            outcome = 'completed' if result.success else 'failed'
+        except Exception as e:
+            logger.error(f"Gateway error for payment {payment_id}: {e}")
+            result, outcome = None, 'error'
+        SETTLEMENT_LATENCY.labels(self.gateway.name, outcome).observe(time.perf_counter() - start)
+        SETTLEMENTS.labels(outcome).inc()
+
+        session.execute(
+            update(model)
+            .where(model.payment_id == payment_id, model.status == 'processing')
+            .values(
+                status='completed' if outcome == 'completed' else 'failed',
+                transaction_id=result.transaction_id if result else None,
+                updated_at=datetime.datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        if outcome == 'completed':
+            logger.info(f"Payment {payment_id} completed successfully")
+        else:
+            logger.warning(f"Payment {payment_id} failed: {result.error if result else 'gateway error'}")
+        return outcome
+
+    def _ensure_started(self):
+        # Потоки не переживают fork gunicorn-воркера - стартуем их лениво в каждом процессе
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f'payment-processor-{i}', daemon=True).start()
+            threading.Thread(target=self._resume_loop, name='payment-processor-resume', daemon=True).start()
+
+    def _resume_loop(self):
+        while True:
+            time.sleep(self.resume_interval)
+            try:
+                with self.app.app_context():
+                    self.resume()
+            except Exception as e:
+                logger.error(f"Resuming stuck payments failed: {e}")
+
+    def _work(self):
+        while True:
+            payment_id = self._queue.get()
+            QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                with self.app.app_context():
+                    self.settle(payment_id)
+            except Exception as e:
+                logger.error(f"Payment processing failed for {payment_id}: {e}")
+                SETTLEMENTS.labels('error').inc()
+            finally:
+                self._queue.task_done()
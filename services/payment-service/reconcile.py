@@ -0,0 +1,126 @@
+"""
+Сверка платежей с заказами order-service.
+
+Платежи читаются потоком в порядке order_id чанками yield_per (на
+PostgreSQL - серверный курсор), заказы для каждого чанка запрашиваются
+пачками GET /api/v1/orders?ids=..., и два отсортированных потока
+сливаются merge-join'ом. В памяти одновременно только один чанк, поэтому RSS
+не зависит от размера таблиц. Результат - поток событий: discrepancy на
+каждое расхождение, progress раз в progress_every платежей и итоговый summary.
+
+Запуск из командной строки (NDJSON в stdout, прогресс в stderr):
+    python reconcile.py > discrepancies.ndjson
+"""
+import datetime
+import json
+import sys
+import time
+import logging
+
+import requests
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_TOLERANCE = 0.005
+STUCK_PROCESSING_AFTER = datetime.timedelta(minutes=15)
+
+
+class OrderFetcher:
+    """Заказы из order-service по списку id; одна keep-alive сессия на всю сверку."""
+
+    def __init__(self, base_url, batch_size=250, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        # ids уходят в query string - держим URL в пределах лимита строки запроса gunicorn
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __call__(self, order_ids):
+        orders = []
+        for start in range(0, len(order_ids), self.batch_size):
+            batch = order_ids[start:start + self.batch_size]
+            response = self.session.get(
+                f'{self.base_url}/api/v1/orders',
+                params={'ids': ','.join(map(str, batch))},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            orders.extend(response.json()['orders'])
+        return orders
+
+    def close(self):
+        self.session.close()
+
+
+def _check(payment, order, now):
+    """Расхождения по одной паре (платёж, заказ или None)."""
+    base = {'type': 'discrepancy', 'payment_id': payment.payment_id, 'order_id': payment.order_id,
+            'payment_status': payment.status}
+    if order is None:
+        yield dict(base, kind='order_missing')
+        return
+    if payment.status == 'completed' and order['status'] == 'cancelled':
+        yield dict(base, kind='completed_payment_on_cancelled_order', order_status=order['status'])
+    if payment.status in ('completed', 'pending', 'processing') and \
+            abs(payment.amount - order['total_price']) > AMOUNT_TOLERANCE:
+        yield dict(base, kind='amount_mismatch', amount=payment.amount, order_total=order['total_price'])
+    if payment.user_id != order['user_id']:
+        yield dict(base, kind='user_mismatch', user_id=payment.user_id, order_user_id=order['user_id'])
+    if payment.status == 'processing' and payment.updated_at < now - STUCK_PROCESSING_AFTER:
+        yield dict(base, kind='stuck_processing', updated_at=payment.updated_at.isoformat())
+
+
+def reconcile(session, model, fetch_orders, chunk_size=1000, progress_every=100000):
+    """Генератор событий сверки; fetch_orders(order_ids) -> список заказов (dict)."""
+    now = datetime.datetime.utcnow()
+    start = time.perf_counter()
+    payments = 0
+    discrepancies = {}
+
+    def progress(event_type):
+        elapsed = time.perf_counter() - start
+        return {'type': event_type, 'payments': payments, 'discrepancies': sum(discrepancies.values()),
+                'elapsed_seconds': round(elapsed, 3),
+                'rows_per_second': round(payments / elapsed) if elapsed else 0}
+
+    rows = session.execute(
+        select(model.payment_id, model.order_id, model.user_id, model.amount, model.status, model.updated_at)
+        .order_by(model.order_id, model.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    next_progress = progress_every
+    for chunk in rows.partitions():
+        order_ids = sorted({payment.order_id for payment in chunk})
+        orders = sorted(fetch_orders(order_ids), key=lambda order: order['id'])
+
+        # Оба потока отсортированы по order_id - сливаем двумя указателями
+        position = 0
+        for payment in chunk:
+            while position < len(orders) and orders[position]['id'] < payment.order_id:
+                position += 1
+            order = orders[position] if position < len(orders) and orders[position]['id'] == payment.order_id else None
+            for event in _check(payment, order, now):
+                discrepancies[event['kind']] = discrepancies.get(event['kind'], 0) + 1
+                yield event
+        payments += len(chunk)
+        if payments >= next_progress:
+            next_progress += progress_every
+            yield progress('progress')
+
+    yield dict(progress('summary'), by_kind=discrepancies)
+
+
+def main():
+    from app import app, db, Payment, ORDER_SERVICE_URL
+    logging.getLogger().setLevel(logging.WARNING)
+    fetcher = OrderFetcher(ORDER_SERVICE_URL)
+    with app.app_context():
+        for event in reconcile(db.session, Payment, fetcher):
+            stream = sys.stdout if event['type'] == 'discrepancy' else sys.stderr
+            stream.write(json.dumps(event) + '\n')
+    fetcher.close()
+
+
+if __name__ == '__main__':
+    main()
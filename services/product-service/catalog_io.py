@@ -0,0 +1,92 @@
+"""
+Потоковый импорт/экспорт каталога.
+
+Тело запроса читается построчно (NDJSON или CSV), строки валидируются по
+одной и отдаются пачками для upsert по sku - в памяти никогда нет больше
+одной пачки. Экспорт сериализует строки по мере чтения серверного курсора.
+"""
+import csv
+import io
+import json
+
+EXPORT_FIELDS = ('id', 'sku', 'name', 'description', 'price', 'stock', 'category', 'created_at', 'updated_at')
+
+
+def iter_rows(stream, mimetype):
+    """Отдаёт (номер строки, нормализованный dict или None, ошибка или None)."""
+    lines = io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8')
+    if mimetype == 'text/csv':
+        rows = enumerate(csv.DictReader(lines), start=1)
+    else:
+        rows = _iter_ndjson(lines)
+    for number, raw in rows:
+        try:
+            yield number, validate_row(raw), None
+        except ValueError as e:
+            yield number, None, str(e)
+
+
+def _iter_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def validate_row(raw):
+    if not isinstance(raw, dict):
+        raise ValueError('Invalid JSON')
+    missing = [f for f in ('sku', 'name', 'price') if raw.get(f) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    try:
+        price = float(raw['price'])
+        stock = int(raw.get('stock') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('price must be a number and stock an integer')
+    if price < 0 or stock < 0:
+        raise ValueError('price and stock must not be negative')
+    return {
+        'sku': str(raw['sku'])[:64],
+        'name': str(raw['name'])[:200],
+        'description': raw.get('description') or None,
+        'price': price,
+        'stock': stock,
+        'category': raw.get('category') or None
+    }
+
+
+def upsert_statement(db, model):
+    """INSERT ... ON CONFLICT (sku) DO UPDATE для PostgreSQL и SQLite."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f'Upsert is not supported for {dialect}')
+    stmt = insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=[model.sku],
+        set_={
+            column: stmt.excluded[column]
+            for column in ('name', 'description', 'price', 'stock', 'category', 'updated_at')
+        }
+    )
+
+
+def export_row(row):
+    item = {field: row._mapping[field] for field in EXPORT_FIELDS}
+    for field in ('created_at', 'updated_at'):
+        if item[field] is not None:
+            item[field] = item[field].isoformat()
+    return item
+
+
+def to_csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
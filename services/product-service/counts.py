@@ -0,0 +1,81 @@
+"""
+Приблизительные количества товаров по категориям.
+
+COUNT(*) на каждую страницу каталога слишком дорог, поэтому счётчики
+считаются одним GROUP BY и живут в памяти процесса. Когда кеш устаревает,
+ответ отдаётся по старым значениям, а пересчёт идёт в фоновом потоке.
+Создание/удаление товара сразу корректирует счётчик на +-1.
+"""
+import threading
+import time
+import logging
+
+from sqlalchemy import func, select
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryCounts:
+    def __init__(self, app, db, model, ttl=30):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+        self._counts = None
+        self._refreshed_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self, category=None):
+        """Количество товаров в категории (или всего при category=None)."""
+        with self._lock:
+            counts = dict(self._counts) if self._counts is not None else None
+            stale = time.monotonic() - self._refreshed_at > self.ttl
+            start_refresh = counts is not None and stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if counts is None:
+            # Первый запрос в процессе - считаем синхронно
+            counts = self._load()
+        elif start_refresh:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+        if category is None:
+            return sum(counts.values())
+        return counts.get(category, 0)
+
+    def exact(self, category=None):
+        query = select(func.count()).select_from(self.model)
+        if category is not None:
+            query = query.where(self.model.category == category)
+        return self.db.session.execute(query).scalar()
+
+    def adjust(self, category, delta):
+        with self._lock:
+            if self._counts is not None:
+                self._counts[category] = max(0, self._counts.get(category, 0) + delta)
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+    def _load(self):
+        rows = self.db.session.execute(
+            select(self.model.category, func.count()).group_by(self.model.category)
+        ).all()
+        counts = {category: count for category, count in rows}
+        with self._lock:
+            self._counts = counts
+            self._refreshed_at = time.monotonic()
+            self._refreshing = False
+        return dict(counts)
+
+    def _refresh_in_background(self):
+        try:
+            with self.app.app_context():
+                self._load()
+        except Exception as e:
+            logger.error(f"Product count refresh failed: {e}")
+            with self._lock:
+                self._refreshing = False
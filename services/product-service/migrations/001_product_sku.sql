@@ -0,0 +1,13 @@
+-- Колонка sku для импорта и экспорта каталога (upsert по sku).
+-- db.create_all() создаёт только отсутствующие таблицы и существующую product
+-- не меняет, поэтому на уже развёрнутой БД колонку добавляет этот скрипт.
+-- Повторный запуск безопасен.
+ALTER TABLE product ADD COLUMN IF NOT EXISTS sku VARCHAR(64);
+
+DO $$
+BEGIN
+    -- Имя как у ограничения, которое создаёт unique=True в модели
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'product_sku_key') THEN
+        ALTER TABLE product ADD CONSTRAINT product_sku_key UNIQUE (sku);
+    END IF;
+END $$;
@@ -0,0 +1,11 @@
+-- Полнотекстовый поиск (GET /api/v1/products/search): колонка tsvector и GIN-индекс.
+-- search.install() вешает этот DDL на after_create таблицы product, а db.create_all()
+-- существующую таблицу не пересоздаёт, поэтому на уже развёрнутой БД их добавляет скрипт.
+-- Повторный запуск безопасен. Генерируемая колонка заполняется для всех строк сразу,
+-- на большом каталоге ALTER держит блокировку таблицы - запускать в окно обслуживания.
+ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING GIN (search_vector);
@@ -0,0 +1,22 @@
+-- То же для локальной SQLite-базы: FTS5-таблица, триггеры и заполнение по уже
+-- существующим товарам. sqlite3 <файл БД> < migrations/002_product_search.sqlite.sql
+CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+    name, description, content='product', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+    INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+    INSERT INTO product_fts(product_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, description ON product BEGIN
+    INSERT INTO product_fts(product_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+
+INSERT INTO product_fts(product_fts) VALUES ('rebuild');
@@ -0,0 +1,5 @@
+-- Индекс (category, id) для keyset-пагинации каталога.
+-- db.create_all() не создаёт индексы на уже существующей таблице product, поэтому
+-- на развёрнутой БД его добавляет этот скрипт. CONCURRENTLY не блокирует запись;
+-- если построение прервалось, удалите невалидный индекс (DROP INDEX) и запустите снова.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_product_category_id ON product (category, id);
@@ -0,0 +1,118 @@
+"""
+Кеш горячих товаров с объединением параллельных промахов (singleflight).
+
+order-service запрашивает один и тот же товар на каждый заказ, поэтому
+get_product читает из LRU с TTL. Если несколько запросов одновременно
+промахнулись по одному id, в БД идёт только первый, остальные ждут его
+результат. Вместе с товаром хранится ETag для ответов 304.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False
+
+
+class ProductCache:
+    def __init__(self, max_size=5000, ttl=30, wait_timeout=5.0, registry=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+
+        kwargs = {'registry': registry} if registry is not None else {}
+        self._requests = Counter(
+            'product_cache_requests_total',
+            'Product cache lookups by result (hit, miss, coalesced)',
+            ['result'],
+            **kwargs
+        )
+        hit_ratio = Gauge(
+            'product_cache_hit_ratio',
+            'Share of product lookups served from cache',
+            **kwargs
+        )
+        hit_ratio.set_function(self.hit_ratio)
+
+    def hit_ratio(self):
+        return self._hits / self._lookups if self._lookups else 0.0
+
+    def get(self, key, loader):
+        """
+        Возвращает (payload, etag) или None, если loader ничего не нашёл.
+
+        loader(key) -> dict | None вызывается не более одного раза на ключ
+        одновременно.
+        """
+        with self._lock:
+            self._lookups += 1
+            entry = self._data.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                self._data.move_to_end(key)
+                self._hits += 1
+                self._requests.labels('hit').inc()
+                return entry[0], entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            self._requests.labels('coalesced').inc()
+            if flight.event.wait(self.wait_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            # Лидер завис - не ждём его дальше, грузим сами
+            return self._wrap(loader(key))
+
+        self._requests.labels('miss').inc()
+        try:
+            flight.result = self._wrap(loader(key))
+            with self._lock:
+                if flight.result is not None and not flight.stale:
+                    self._data[key] = (*flight.result, time.monotonic() + self.ttl)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.max_size:
+                        self._data.popitem(last=False)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            flight = self._inflight.get(key)
+            if flight is not None:
+                # Загрузка уже идёт и может вернуть старые данные - не кладём их в кеш
+                flight.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @staticmethod
+    def _wrap(payload):
+        if payload is None:
+            return None
+        etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        return payload, etag
@@ -0,0 +1,86 @@
+"""
+Полнотекстовый поиск по name/description.
+
+PostgreSQL: генерируемая колонка tsvector + GIN-индекс, обновляется самой БД.
+SQLite (тесты, локальный запуск): внешняя FTS5-таблица, которую держат в
+актуальном состоянии триггеры на INSERT/UPDATE/DELETE. Оба варианта
+создаются вместе с таблицей product в db.create_all(); на базе, где product
+уже была, их добавляет migrations/002_product_search*.sql.
+"""
+import re
+
+from sqlalchemy import DDL, event, select, text
+
+SEARCH_CONFIG = 'simple'
+
+_PG_DDL = [
+    f"""ALTER TABLE product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX ix_product_search_vector ON product USING GIN (search_vector)",
+]
+
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE product_fts USING fts5(
+        name, description, content='product', content_rowid='id'
+    )""",
+    """CREATE TRIGGER product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER product_fts_update AFTER UPDATE OF name, description ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+_PG_SEARCH = """
+    SELECT {columns} FROM product, to_tsquery(:config, :query) AS query
+    WHERE product.search_vector @@ query
+    ORDER BY ts_rank_cd(product.search_vector, query) DESC, product.id
+    LIMIT :limit
+"""
+
+_SQLITE_SEARCH = """
+    SELECT {columns} FROM product_fts JOIN product ON product.id = product_fts.rowid
+    WHERE product_fts MATCH :query
+    ORDER BY bm25(product_fts, 10.0, 1.0), product.id
+    LIMIT :limit
+"""
+
+
+def install(table):
+    """Вешает DDL поискового индекса на создание/удаление таблицы."""
+    for statement in _PG_DDL:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in _SQLITE_DDL:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL('DROP TABLE IF EXISTS product_fts').execute_if(dialect='sqlite'))
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search(db, model, query, limit):
+    """Товары по релевантности; каждое слово запроса ищется как префикс."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    # Только колонки модели: tsvector клиенту не нужен
+    columns = ', '.join(f'product.{column.name}' for column in model.__table__.columns)
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        statement = text(_PG_SEARCH.format(columns=columns)).bindparams(
+            config=SEARCH_CONFIG, query=' & '.join(f'{t}:*' for t in terms), limit=limit)
+    elif dialect == 'sqlite':
+        statement = text(_SQLITE_SEARCH.format(columns=columns)).bindparams(
+            query=' '.join(f'"{t}"*' for t in terms), limit=limit)
+    else:
+        raise RuntimeError(f'Full-text search is not supported for {dialect}')
+    return db.session.execute(select(model).from_statement(statement)).scalars().all()
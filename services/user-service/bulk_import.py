@@ -0,0 +1,113 @@
+"""
+Фоновый массовый импорт пользователей.
+
+PBKDF2 на сотнях строк не укладывается в таймаут gunicorn, поэтому
+POST /api/v1/users/bulk только разбирает тело, сохраняет задачу и отвечает
+202, а строки импортирует фоновый поток воркера. Пул процессов для
+хеширования создаётся только под межпроцессной файловой блокировкой:
+на хосте одновременно работает один пул из BULK_HASH_WORKERS процессов,
+задачи остальных воркеров ждут блокировку в своих очередях.
+"""
+import fcntl
+import os
+import queue
+import threading
+import time
+import logging
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+IMPORT_QUEUE_DEPTH = Gauge(
+    'user_bulk_import_queue_depth',
+    'Bulk import jobs waiting in this worker'
+)
+IMPORT_JOBS = Counter(
+    'user_bulk_import_jobs_total',
+    'Bulk import jobs by result',
+    ['outcome']
+)
+
+
+class ImportQueueFull(Exception):
+    """Очередь импорта воркера заполнена - клиенту нужно повторить позже."""
+
+
+class BulkImporter:
+    def __init__(self, app, handler, lock_path, queue_size=4, heartbeat=None, heartbeat_interval=10.0):
+        self.app = app
+        self.handler = handler
+        self.lock_path = lock_path
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._waiting = set()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def full(self):
+        return self._queue.full()
+
+    def submit(self, job_id, rows):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((job_id, rows))
+        except queue.Full:
+            IMPORT_JOBS.labels('rejected').inc()
+            raise ImportQueueFull(f'{self._queue.qsize()} imports already queued')
+        with self._lock:
+            self._waiting.add(job_id)
+        IMPORT_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def waiting(self):
+        """id задач, ждущих своей очереди в этом воркере."""
+        with self._lock:
+            return list(self._waiting)
+
+    def join(self):
+        """Ждёт, пока очередь опустеет (для тестов и graceful shutdown)."""
+        self._queue.join()
+
+    def _ensure_started(self):
+        # Поток не переживает fork gunicorn-воркера - стартуем его лениво в каждом процессе
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._work, name='bulk-import', daemon=True).start()
+
+    def _work(self):
+        while True:
+            job_id, rows = self._queue.get()
+            IMPORT_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                with open(self.lock_path, 'a') as lock_file:
+                    self._acquire(lock_file)
+                    with self._lock:
+                        self._waiting.discard(job_id)
+                    with self.app.app_context():
+                        self.handler(job_id, rows)
+                IMPORT_JOBS.labels('completed').inc()
+            except Exception as e:
+                logger.error(f"Bulk import job {job_id} failed: {e}")
+                IMPORT_JOBS.labels('error').inc()
+            finally:
+                with self._lock:
+                    self._waiting.discard(job_id)
+                self._queue.task_done()
+
+    def _acquire(self, lock_file):
+        """Ждёт блокировку хоста, продлевая heartbeat ждущих задач, чтобы их не сочли брошенными."""
+        next_beat = time.monotonic()
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                pass
+            if self.heartbeat and time.monotonic() >= next_beat:
+                with self.app.app_context():
+                    self.heartbeat(self.waiting())
+                next_beat = time.monotonic() + self.heartbeat_interval
+            time.sleep(0.5)
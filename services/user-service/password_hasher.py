@@ -0,0 +1,131 @@
+"""
+Хеширование паролей вне gunicorn-воркера.
+
+PBKDF2 полностью занимает CPU, поэтому generate/check выполняются в
+отдельном пуле процессов. Число задач "в полёте" ограничено: если очередь
+заполнена, вызывающий получает HashingUnavailable и отвечает клиенту 503.
+Лимит и пул - на процесс gunicorn, поэтому сервис работает на gthread:
+потоки одного воркера делят пул и упираются в общий лимит.
+"""
+import os
+import threading
+import time
+import logging
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from prometheus_client import Counter, Gauge, Histogram
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+HASH_LATENCY = Histogram(
+    'user_password_hash_seconds',
+    'Time spent hashing or verifying a password, including queueing',
+    ['operation'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+HASH_QUEUE_DEPTH = Gauge(
+    'user_password_hash_queue_depth',
+    'Password hashing jobs currently queued or running'
+)
+HASH_REJECTED = Counter(
+    'user_password_hash_rejected_total',
+    'Password hashing jobs rejected because the pool was saturated or timed out',
+    ['operation', 'reason']
+)
+
+
+class HashingUnavailable(Exception):
+    """Пул хеширования перегружен или не ответил вовремя."""
+
+
+class PasswordHasher:
+    """Ограниченный пул процессов для PBKDF2 с настраиваемой стоимостью."""
+
+    def __init__(self, iterations=600000, workers=2, queue_limit=8, timeout=10.0):
+        self.method = f'pbkdf2:sha256:{iterations}'
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run('verify', check_password_hash, pwhash, password)
+
+    def bulk_executor(self, workers):
+        """Отдельный пул для массового импорта; BulkImporter держит не больше одного такого на хост."""
+        return ProcessPoolExecutor(max_workers=workers)
+
+    def hash_many(self, passwords, executor):
+        start = time.perf_counter()
+        try:
+            return list(executor.map(generate_password_hash, passwords, repeat(self.method), chunksize=8))
+        finally:
+            HASH_LATENCY.labels('bulk_hash').observe(time.perf_counter() - start)
+
+    def needs_rehash(self, pwhash):
+        """True, если хеш посчитан с другой стоимостью, чем настроена сейчас."""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def _get_executor(self):
+        # gunicorn форкает воркеры после импорта app, поэтому пул создаётся
+        # лениво и пересоздаётся, если мы оказались в другом процессе.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _reset_executor(self):
+        logger.error("Password hashing pool is broken, recreating")
+        with self._lock:
+            self._executor = None
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+            HASH_QUEUE_DEPTH.set(self._in_flight)
+
+    def _run(self, operation, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.queue_limit:
+                HASH_REJECTED.labels(operation, 'queue_full').inc()
+                raise HashingUnavailable(f'{self._in_flight} hashing jobs already in flight')
+            self._in_flight += 1
+            HASH_QUEUE_DEPTH.set(self._in_flight)
+
+        start = time.perf_counter()
+        try:
+            if self.workers <= 0:
+                # Без пула (локальный запуск, отладка) считаем прямо в воркере
+                try:
+                    return fn(*args)
+                finally:
+                    self._release()
+
+            try:
+                with self._lock:
+                    future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                self._release()
+                self._reset_executor()
+                raise HashingUnavailable('hashing pool is broken')
+            future.add_done_callback(self._release)
+
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                HASH_REJECTED.labels(operation, 'timeout').inc()
+                raise HashingUnavailable(f'hashing did not finish within {self.timeout}s')
+            except BrokenProcessPool:
+                self._reset_executor()
+                raise HashingUnavailable('hashing pool is broken')
+        finally:
+            HASH_LATENCY.labels(operation).observe(time.perf_counter() - start)
@@ -0,0 +1,124 @@
+"""
+Read-through кеш профилей пользователей.
+
+Профили живут в LRU с TTL внутри процесса. Промахи догружаются пачкой через
+loader (один IN-запрос на все отсутствующие id), записи в БД явно
+инвалидируют кеш после коммита. Если инвалидация пришла, пока загрузка
+ещё идёт, загруженный профиль может быть старым - такой результат
+возвращается вызывающему, но в кеш не попадает. Попадания, промахи и
+вытеснения видны в Prometheus.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+
+class _Load:
+    def __init__(self, ids):
+        self.ids = set(ids)
+        self.stale = set()
+
+
+class ProfileCache:
+    """LRU + TTL кеш словарей профилей по id пользователя."""
+
+    def __init__(self, max_size=10000, ttl=60, registry=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._loads = set()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        kwargs = {'registry': registry} if registry is not None else {}
+        self._requests = Counter(
+            'user_profile_cache_requests_total',
+            'Profile cache lookups',
+            ['result'],
+            **kwargs
+        )
+        self._evictions = Counter(
+            'user_profile_cache_evictions_total',
+            'Profile cache entries removed',
+            ['reason'],
+            **kwargs
+        )
+        hit_ratio = Gauge(
+            'user_profile_cache_hit_ratio',
+            'Share of profile lookups served from cache',
+            **kwargs
+        )
+        hit_ratio.set_function(self.hit_ratio)
+
+    def hit_ratio(self):
+        total = self._hits + self._misses
+        return self._hits / total if total else 0.0
+
+    def get_many(self, ids, loader):
+        """
+        Возвращает {id: профиль} для найденных id.
+
+        loader(missing_ids) -> {id: профиль} вызывается один раз на все промахи.
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for user_id in ids:
+                entry = self._data.get(user_id)
+                if entry is not None and entry[1] > now:
+                    self._data.move_to_end(user_id)
+                    found[user_id] = entry[0]
+                    continue
+                if entry is not None:
+                    del self._data[user_id]
+                    self._evictions.labels('expired').inc()
+                missing.append(user_id)
+            self._hits += len(found)
+            self._misses += len(missing)
+            if missing:
+                load = _Load(missing)
+                self._loads.add(load)
+        if found:
+            self._requests.labels('hit').inc(len(found))
+        if not missing:
+            return found
+
+        self._requests.labels('miss').inc(len(missing))
+        try:
+            loaded = loader(missing)
+        finally:
+            with self._lock:
+                self._loads.discard(load)
+        self.put_many({user_id: profile for user_id, profile in loaded.items()
+                       if user_id not in load.stale})
+        found.update(loaded)
+        return found
+
+    def put_many(self, profiles):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for user_id, profile in profiles.items():
+                self._data[user_id] = (profile, expires_at)
+                self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._evictions.labels('capacity').inc()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._data.pop(user_id, None) is not None:
+                self._evictions.labels('invalidated').inc()
+            for load in self._loads:
+                # Загрузка уже идёт и может вернуть старые данные - не кладём их в кеш
+                if user_id in load.ids:
+                    load.stale.add(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            for load in self._loads:
+                load.stale.update(load.ids)
@@ -0,0 +1,82 @@
+"""
+Локальная проверка JWT с кешем уже проверенных токенов.
+
+Модуль зависит только от PyJWT и prometheus_client, поэтому его можно
+скопировать в любой сервис и проверять Authorization у себя, не ходя в
+user-service. Повторные запросы с тем же токеном не тратят время на HMAC и
+разбор JSON: результат берётся из LRU-кеша, запись живёт не дольше exp.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from prometheus_client import Counter
+
+
+class TokenVerifier:
+    """Проверяет HS256 access-токены, кеширует декодированные claims."""
+
+    def __init__(self, secret, max_size=10000, max_ttl=300, metrics=None, algorithms=('HS256',)):
+        self.secret = secret
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.algorithms = list(algorithms)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        registry = metrics.registry if metrics is not None else None
+        kwargs = {'registry': registry} if registry is not None else {}
+        self._lookups = Counter(
+            'jwt_verify_cache_total',
+            'Token verification cache lookups',
+            ['result'],
+            **kwargs
+        )
+
+    def verify(self, token):
+        """Возвращает claims или бросает jwt.InvalidTokenError."""
+        key = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at > now:
+                    self._cache.move_to_end(key)
+                    self._lookups.labels('hit').inc()
+                    return dict(claims)
+                del self._cache[key]
+        self._lookups.labels('miss').inc()
+
+        claims = jwt.decode(token, self.secret, algorithms=self.algorithms)
+        if claims.get('type', 'access') != 'access':
+            raise jwt.InvalidTokenError('Not an access token')
+
+        expires_at = min(claims.get('exp', now), now + self.max_ttl)
+        if expires_at > now:
+            with self._lock:
+                self._cache[key] = (claims, expires_at)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return dict(claims)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def token_from_header(header):
+    """Достаёт токен из заголовка 'Authorization: Bearer <token>'."""
+    if not header:
+        return None
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
@@ -0,0 +1,85 @@
+"""
+Access/refresh токены user-service.
+
+Access token - короткоживущий HS256 JWT. Refresh token - случайная строка,
+в БД хранится только её sha256, так что обновление пары токенов - это один
+поиск по индексу без проверки пароля. Уже использованные (ротированные)
+refresh-токены попадают в RevocationList, чтобы повторы отсекались без БД.
+"""
+import hashlib
+import heapq
+import secrets
+import threading
+import time
+import datetime
+
+import jwt
+
+
+def issue_access_token(user, secret, ttl):
+    return jwt.encode({
+        'user_id': user.id,
+        'username': user.username,
+        'type': 'access',
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl)
+    }, secret, algorithm='HS256')
+
+
+def new_refresh_token():
+    """Возвращает пару (токен для клиента, хеш для БД)."""
+    token = secrets.token_urlsafe(32)
+    return token, hash_refresh_token(token)
+
+
+def hash_refresh_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RevocationList:
+    """
+    Множество отозванных хешей токенов с вытеснением по TTL.
+
+    Хранятся только первые 16 байт дайджеста, а истёкшие записи снимаются
+    с кучи по времени истечения - память ограничена числом токенов, которые
+    ещё могли бы быть предъявлены.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._expiry = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token_hash):
+        return bytes.fromhex(token_hash)[:16]
+
+    def add(self, token_hash, expires_at):
+        key = self._key(token_hash)
+        with self._lock:
+            self._evict(time.time())
+            while len(self._expiry) >= self.max_size and self._heap:
+                # Переполнение: выкидываем ту запись, что истекает раньше всех
+                expires, oldest = heapq.heappop(self._heap)
+                if self._expiry.get(oldest) == expires:
+                    del self._expiry[oldest]
+            self._expiry[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+
+    def __contains__(self, token_hash):
+        key = self._key(token_hash)
+        now = time.time()
+        with self._lock:
+            expires_at = self._expiry.get(key)
+            return expires_at is not None and expires_at > now
+
+    def __len__(self):
+        with self._lock:
+            self._evict(time.time())
+            return len(self._expiry)
+
+    def _evict(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expiry.get(key) == expires_at:
+                del self._expiry[key]
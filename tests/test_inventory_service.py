@@ -0,0 +1,156 @@
+import random
+import threading
+import pytest
+import app as inventory_app
+from app import app, SEED_INVENTORY
+from repository import (InventoryRepository, MemoryInventoryRepository, SQLiteInventoryRepository, ProductNotFound,
+                        InsufficientStock, ReleaseExceedsReserved, LOCK_WAIT)
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def repository(request, tmp_path, monkeypatch):
+    """Inventory backend under test, seeded with the default products"""
+    if request.param == 'memory':
+        repository = MemoryInventoryRepository(SEED_INVENTORY)
+    else:
+        repository = SQLiteInventoryRepository(str(tmp_path / 'inventory.db'), SEED_INVENTORY)
+    monkeypatch.setattr(inventory_app, 'inventory', repository)
+    return repository
+
+def _count(backend):
+    return next(sample.value for metric in LOCK_WAIT.collect() for sample in metric.samples
+                if sample.name.endswith('_count') and sample.labels['backend'] == backend)
+
+@pytest.fixture
+def client(repository):
+    """Create a test client for the Flask app"""
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+class TestInventoryService:
+    """Test cases for Inventory Service"""
+
+    def test_check_stock(self, client):
+        """Test stock check reports available units"""
+        response = client.get('/inventory/PROD-001')
+
+        assert response.status_code == 200
+        assert response.get_json()['available'] == 45
+        assert client.get('/inventory/PROD-404').status_code == 404
+
+    def test_reserve_and_release(self, client):
+        """Test reserving and releasing stock"""
+        reserved = client.post('/inventory/PROD-001/reserve', json={'quantity': 5, 'order_id': 'ORD-1'})
+        released = client.post('/inventory/PROD-001/release', json={'quantity': 2, 'order_id': 'ORD-1'})
+
+        assert reserved.status_code == 200
+        assert reserved.get_json()['remaining_available'] == 40
+        assert released.get_json()['current_reserved'] == 8
+
+    def test_reserve_rejects_overselling(self, client):
+        """Test a reservation larger than the available stock is refused"""
+        response = client.post('/inventory/PROD-001/reserve', json={'quantity': 46, 'order_id': 'ORD-1'})
+
+        assert response.status_code == 400
+        assert response.get_json()['available'] == 45
+        assert client.post('/inventory/PROD-001/release', json={'quantity': 6, 'order_id': 'ORD-1'}).status_code == 400
+        assert client.post('/inventory/PROD-001/reserve', json={'quantity': -1, 'order_id': 'ORD-1'}).status_code == 400
+        assert client.post('/inventory/PROD-404/reserve', json={'quantity': 1, 'order_id': 'ORD-1'}).status_code == 404
+
+    def test_update_and_add(self, client):
+        """Test stock updates respect reservations and new products start unreserved"""
+        assert client.put('/inventory/PROD-001', json={'quantity': 4}).status_code == 400
+        assert client.put('/inventory/PROD-001', json={'quantity': 60}).get_json()['product']['quantity'] == 60
+
+        added = client.post('/inventory', json={'product_id': 'PROD-006', 'name': 'Webcam', 'quantity': 8, 'price': 49.9})
+        duplicate = client.post('/inventory', json={'product_id': 'PROD-006', 'name': 'Webcam', 'quantity': 8, 'price': 49.9})
+
+        assert added.status_code == 201
+        assert duplicate.status_code == 400
+        assert client.get('/stats').get_json()['total_products'] == 6
+        assert 'PROD-006' in client.get('/inventory/low-stock?threshold=10').get_json()['items']
+
+    def test_bad_quantity_is_rejected_not_reported_as_duplicate(self, client):
+        """Test invalid quantities answer 400 with their own error instead of 'already exists' or 500"""
+        negative = client.post('/inventory', json={'product_id': 'PROD-007', 'name': 'Cable', 'quantity': -1, 'price': 5})
+        garbage = client.post('/inventory', json={'product_id': 'PROD-007', 'name': 'Cable', 'quantity': 'lots', 'price': 5})
+
+        assert negative.status_code == 400
+        assert 'already exists' not in negative.get_json()['error']
+        assert garbage.status_code == 400
+        assert client.put('/inventory/PROD-001', json={'quantity': -5}).status_code == 400
+        assert client.get('/inventory/PROD-007').status_code == 404
+
+    def test_repository_interface_is_abstract(self):
+        """Test the repository base cannot be instantiated without the storage methods"""
+        with pytest.raises(TypeError):
+            InventoryRepository()
+
+    def test_sqlite_backend_is_shared_between_workers(self, tmp_path):
+        """Test two repositories on the same file (two gunicorn workers) see each other's reservations"""
+        path = str(tmp_path / 'inventory.db')
+        worker_1 = SQLiteInventoryRepository(path, SEED_INVENTORY)
+        worker_2 = SQLiteInventoryRepository(path, SEED_INVENTORY)
+
+        worker_1.reserve('PROD-001', 40)
+
+        assert worker_2.get('PROD-001')['reserved'] == 45
+        with pytest.raises(InsufficientStock):
+            worker_2.reserve('PROD-001', 6)
+        with pytest.raises(ProductNotFound):
+            worker_2.release('PROD-404', 1)
+
+    def test_concurrent_reservations_never_oversell(self, repository):
+        """Stress test: thousands of concurrent reservations and releases keep reserved <= quantity"""
+        repository.add('HOT-1', 'Hot item', 500, 1.0)
+        threads, per_thread = 16, 250
+        barrier = threading.Barrier(threads)
+        outcomes = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            reserved = released = 0
+            barrier.wait()
+            for _ in range(per_thread):
+                quantity = rng.randint(1, 3)
+                try:
+                    item = repository.reserve('HOT-1', quantity)
+                    reserved += quantity
+                    assert item['reserved'] <= item['quantity']
+                except InsufficientStock:
+                    pass
+                if rng.random() < 0.2:
+                    try:
+                        repository.release('HOT-1', 1)
+                        released += 1
+                    except ReleaseExceedsReserved:
+                        pass
+            outcomes.append((reserved, released))
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        item = repository.get('HOT-1')
+        reserved = sum(r for r, _ in outcomes)
+        released = sum(r for _, r in outcomes)
+        assert len(outcomes) == threads
+        assert 0 <= item['reserved'] <= item['quantity']
+        # Every successful call is accounted for exactly once - no lost updates
+        assert item['reserved'] == reserved - released
+        assert reserved > item['quantity']
+
+    def test_lock_wait_is_exported(self, client):
+        """Test reservations record lock wait time in the histogram"""
+        backend = inventory_app.inventory.name
+        before = _count(backend)
+
+        client.post('/inventory/PROD-002/reserve', json={'quantity': 1, 'order_id': 'ORD-1'})
+
+        assert _count(backend) == before + 1
+        assert b'inventory_lock_wait_seconds_bucket' in client.get('/metrics').data
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
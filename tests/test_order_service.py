@@ -0,0 +1,732 @@
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import app as order_app
+from app import (app, db, Order, StockOutbox, product_client, payment_client, order_intake, stock_outbox,
+                 summary_cache, idempotency_store)
+from http_client import ServiceClient, CircuitBreaker, CircuitOpenError
+from archive import Archive
+
+class FakeResponse:
+    """Minimal stand-in for requests.Response"""
+
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+
+    summary_cache.clear()
+    idempotency_store.clear_cache()
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+        with app.app_context():
+            db.drop_all()
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """Point the order archive at an empty temporary directory"""
+    archive = Archive(str(tmp_path), 'orders', sort_key='user_id', lookup_keys=('id',), block_rows=2)
+    monkeypatch.setattr(order_app, 'order_archive', archive)
+    return archive
+
+@pytest.fixture
+def product_service(monkeypatch):
+    """Fake product-service: product 1 costs 10.0 with 5 in stock, product 3 costs 2.5 with 1 in stock"""
+    calls = []
+    products = {1: {'id': 1, 'price': 10.0, 'stock': 5}, 3: {'id': 3, 'price': 2.5, 'stock': 1}}
+
+    def fake_get(path, **kwargs):
+        calls.append(('GET', path))
+        if path == '/api/v1/products':
+            ids = [int(i) for i in kwargs['params']['ids'].split(',')]
+            return FakeResponse(200, {'products': [products[i] for i in ids if i in products],
+                                      'missing': [i for i in ids if i not in products]})
+        product_id = int(path.rsplit('/', 1)[-1])
+        if product_id in products:
+            return FakeResponse(200, products[product_id])
+        return FakeResponse(404, {'error': 'Product not found'})
+
+    def fake_patch(path, **kwargs):
+        calls.append(('PATCH', path, kwargs.get('json')))
+        return FakeResponse(200, {})
+
+    def fake_post(path, **kwargs):
+        calls.append(('POST', path, kwargs.get('json')))
+        return FakeResponse(201, {'payment': {'payment_id': 'pay-1'}})
+
+    monkeypatch.setattr(stock_outbox, 'autostart', False)
+    monkeypatch.setattr(product_client, 'get', fake_get)
+    monkeypatch.setattr(product_client, 'patch', fake_patch)
+    monkeypatch.setattr(payment_client, 'post', fake_post)
+    return calls
+
+@pytest.fixture
+def upstream():
+    """Local HTTP server answering 503 for the first N requests, then 200"""
+    state = {'failures': 0, 'requests': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            state['requests'] += 1
+            status = 503 if state['requests'] <= state['failures'] else 200
+            self.send_response(status)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        do_PATCH = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}', state
+    server.shutdown()
+
+class TestOrderService:
+    """Test cases for Order Service"""
+
+    def test_health_check(self, client):
+        """Test health endpoint"""
+        response = client.get('/health')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'healthy'
+
+    def test_create_order(self, client, product_service):
+        """Test order creation prices the order and queues the stock decrement"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2})
+
+        assert response.status_code == 201
+        assert response.get_json()['order']['total_price'] == 20.0
+        with app.app_context():
+            assert stock_outbox.dispatch_pending() == 1
+        assert ('PATCH', '/api/v1/products/stock', {'items': [{'product_id': 1, 'quantity': -2}]}) in product_service
+
+    def test_stock_outbox_coalesces_deltas(self, client, product_service):
+        """Test several orders and a cancellation become one bulk stock call"""
+        first = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2}).get_json()
+        client.post('/api/v1/orders', json={'user_id': 2, 'product_id': 1, 'quantity': 3})
+        client.post(f"/api/v1/orders/{first['order']['id']}/cancel")
+        client.post(f"/api/v1/orders/{first['order']['id']}/cancel")
+
+        with app.app_context():
+            assert stock_outbox.dispatch_pending() == 3
+            assert StockOutbox.query.filter_by(status='pending').count() == 0
+
+        bulk_calls = [call for call in product_service if call[1] == '/api/v1/products/stock']
+        assert bulk_calls == [('PATCH', '/api/v1/products/stock', {'items': [{'product_id': 1, 'quantity': -3}]})]
+
+    def test_stock_outbox_redelivers_with_same_key(self, client, product_service, monkeypatch):
+        """Test an undelivered batch stays pending and is resent with its idempotency key"""
+        keys = []
+
+        def flaky_patch(path, **kwargs):
+            keys.append(kwargs['headers']['Idempotency-Key'])
+            if len(keys) == 1:
+                raise requests.ConnectionError('product-service down')
+            return FakeResponse(200, {})
+
+        monkeypatch.setattr(product_client, 'patch', flaky_patch)
+        monkeypatch.setattr(stock_outbox, 'lease', 0)
+        client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2})
+
+        with app.app_context():
+            assert stock_outbox.dispatch_pending() == 0
+            assert StockOutbox.query.filter_by(status='pending').count() == 1
+            assert stock_outbox.dispatch_pending() == 1
+
+        assert len(keys) == 2 and keys[0] == keys[1]
+
+    def test_stock_outbox_isolates_rejected_product(self, client, product_service, monkeypatch):
+        """Test a product rejected by product-service does not block the rest of the batch"""
+        sent = []
+
+        def fake_patch(path, **kwargs):
+            items = kwargs['json']['items']
+            if any(item['product_id'] == 7 for item in items):
+                return FakeResponse(400, {'error': 'Insufficient stock', 'product_id': 7})
+            sent.append(items)
+            return FakeResponse(200, {})
+
+        monkeypatch.setattr(product_client, 'patch', fake_patch)
+        with app.app_context():
+            for product_id in (1, 7):
+                db.session.add(StockOutbox(order_id=1, product_id=product_id, quantity=-1))
+            db.session.commit()
+
+            assert stock_outbox.dispatch_pending() == 1
+            assert StockOutbox.query.filter_by(status='failed').one().product_id == 7
+
+        assert sent == [[{'product_id': 1, 'quantity': -1}]]
+
+    def test_stock_outbox_rejection_cancels_order(self, client, product_service, monkeypatch):
+        """Test an order whose stock decrement is rejected is cancelled and its other lines released"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'items': [
+            {'product_id': 1, 'quantity': 2},
+            {'product_id': 3, 'quantity': 1}
+        ]})
+        order_id = response.get_json()['order']['id']
+
+        def fake_patch(path, **kwargs):
+            if any(item['product_id'] == 3 for item in kwargs['json']['items']):
+                return FakeResponse(400, {'error': 'Insufficient stock', 'product_id': 3})
+            return FakeResponse(200, {})
+
+        monkeypatch.setattr(product_client, 'patch', fake_patch)
+        with app.app_context():
+            assert stock_outbox.dispatch_pending() == 2
+            rows = sorted((row.product_id, row.quantity, row.status) for row in StockOutbox.query)
+        assert rows == [(1, -2, 'sent'), (1, 2, 'sent'), (3, -1, 'failed')]
+        order = client.get(f'/api/v1/orders/{order_id}').get_json()
+        assert (order['status'], order['status_reason']) == ('cancelled', 'Stock reservation rejected')
+
+    def test_stock_outbox_rejected_batch_keeps_returns(self, client, product_service, monkeypatch):
+        """Test a rejected net delta keeps returns and fails only the reservation that does not fit"""
+        stock = {1: 1}
+
+        def fake_patch(path, **kwargs):
+            items = kwargs['json']['items']
+            if any(stock[item['product_id']] + item['quantity'] < 0 for item in items):
+                return FakeResponse(400, {'error': 'Insufficient stock', 'product_id': 1})
+            for item in items:
+                stock[item['product_id']] += item['quantity']
+            return FakeResponse(200, {})
+
+        monkeypatch.setattr(product_client, 'patch', fake_patch)
+        with app.app_context():
+            db.session.add_all([
+                Order(user_id=1, product_id=1, quantity=2, total_price=20.0, status='cancelled'),
+                Order(user_id=1, product_id=1, quantity=3, total_price=30.0, status='pending'),
+                Order(user_id=1, product_id=1, quantity=1, total_price=10.0, status='pending'),
+                StockOutbox(order_id=1, product_id=1, quantity=2),
+                StockOutbox(order_id=2, product_id=1, quantity=-3),
+                StockOutbox(order_id=3, product_id=1, quantity=-1)
+            ])
+            db.session.commit()
+
+            assert stock_outbox.dispatch_pending() == 2
+            rows = {row.order_id: row.status for row in StockOutbox.query}
+            statuses = {order.id: order.status for order in Order.query}
+
+        # 1 in stock: order 3 fits, order 2 does not, the return of order 1 is still delivered
+        assert rows == {1: 'sent', 2: 'failed', 3: 'sent'}
+        assert statuses == {1: 'cancelled', 2: 'cancelled', 3: 'pending'}
+        assert stock == {1: 2}
+
+    def test_start_background_starts_stock_outbox(self, client, monkeypatch):
+        """Test the dispatcher starts with the worker, not only on the next notify()"""
+        started = []
+        monkeypatch.setattr(stock_outbox, '_ensure_started', lambda: started.append(True))
+        monkeypatch.setattr(order_intake, 'submit', lambda order_id: None)
+
+        order_app.start_background()
+
+        assert started == [True]
+
+    def test_create_order_unknown_product(self, client, product_service):
+        """Test order creation for a missing product"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 2, 'quantity': 1})
+        assert response.status_code == 404
+
+    def test_create_multi_item_order(self, client, product_service):
+        """Test a cart is resolved with one product call and stored as one order with lines"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'items': [
+            {'product_id': 1, 'quantity': 2},
+            {'product_id': 3, 'quantity': 1}
+        ]})
+
+        assert response.status_code == 201
+        body = response.get_json()
+        assert body['order']['total_price'] == 22.5
+        assert [line['status'] for line in body['items']] == ['ok', 'ok']
+        assert [item['line_total'] for item in body['order']['items']] == [20.0, 2.5]
+        assert [call for call in product_service if call[0] == 'GET'] == [('GET', '/api/v1/products')]
+
+        client.post(f"/api/v1/orders/{body['order']['id']}/cancel")
+        with app.app_context():
+            deltas = sorted((row.product_id, row.quantity) for row in StockOutbox.query.all())
+        assert deltas == [(1, -2), (1, 2), (3, -1), (3, 1)]
+
+    def test_create_multi_item_order_reports_failed_lines(self, client, product_service):
+        """Test one bad line rejects the cart and each line reports its own result"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'items': [
+            {'product_id': 1, 'quantity': 2},
+            {'product_id': 3, 'quantity': 4},
+            {'product_id': 9, 'quantity': 1}
+        ]})
+
+        assert response.status_code == 400
+        assert [line['status'] for line in response.get_json()['items']] == ['ok', 'insufficient_stock', 'not_found']
+        with app.app_context():
+            assert Order.query.count() == 0
+
+    def test_user_orders_keyset_pagination(self, client):
+        """Test user order history is newest first, filtered in SQL and paged by cursor"""
+        start = datetime.datetime(2024, 1, 1)
+        with app.app_context():
+            for day in range(5):
+                db.session.add(Order(user_id=1, product_id=1, quantity=1, total_price=10.0,
+                                     status='cancelled' if day == 2 else 'pending',
+                                     created_at=start + datetime.timedelta(days=day)))
+            db.session.add(Order(user_id=2, product_id=1, quantity=1, total_price=10.0, created_at=start))
+            db.session.commit()
+
+        first = client.get('/api/v1/orders/user/1?limit=2&status=pending')
+        cursor = first.headers['X-Next-Cursor']
+        second = client.get(f'/api/v1/orders/user/1?limit=2&status=pending&cursor={cursor}')
+
+        days = [o['created_at'][:10] for o in first.get_json() + second.get_json()]
+        assert days == ['2024-01-05', '2024-01-04', '2024-01-02', '2024-01-01']
+        assert 'X-Next-Cursor' not in second.headers
+
+        ranged = client.get('/api/v1/orders/user/1?since=2024-01-02&until=2024-01-04').get_json()
+        assert [o['created_at'][:10] for o in ranged] == ['2024-01-03', '2024-01-02']
+        assert client.get('/api/v1/orders/user/1?status=lost').status_code == 400
+
+    def test_orders_summary_grouped_by_user_and_week(self, client):
+        """Test counts, totals and status breakdown come from one grouped query"""
+        with app.app_context():
+            # 2024-01-01 is a Monday: days 0-6 fall in one week, day 7 in the next
+            for user_id, day, status, price in [(1, 0, 'pending', 10.0), (1, 3, 'cancelled', 5.0),
+                                                (1, 7, 'pending', 2.0), (2, 1, 'pending', 1.0)]:
+                db.session.add(Order(user_id=user_id, product_id=1, quantity=1, total_price=price, status=status,
+                                     created_at=datetime.datetime(2024, 1, 1) + datetime.timedelta(days=day)))
+            db.session.commit()
+
+        body = client.get('/api/v1/orders/summary?group_by=user,week').get_json()
+
+        assert [(g['user_id'], g['period'], g['orders'], g['total']) for g in body['groups']] == [
+            (1, '2024-01-01', 2, 15.0), (1, '2024-01-08', 1, 2.0), (2, '2024-01-01', 1, 1.0)]
+        assert body['groups'][0]['by_status'] == {'cancelled': {'orders': 1, 'total': 5.0},
+                                                  'pending': {'orders': 1, 'total': 10.0}}
+        assert body['totals']['orders'] == 4
+        assert client.get('/api/v1/orders/summary?group_by=day,week').status_code == 400
+
+    def test_orders_summary_cache_invalidated_on_write(self, client, product_service):
+        """Test repeated summaries are cached until an order of that user changes"""
+        client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 1})
+        first = client.get('/api/v1/orders/summary?user_id=1').get_json()
+        with app.app_context():
+            db.session.add(Order(user_id=1, product_id=1, quantity=1, total_price=99.0, status='pending'))
+            db.session.flush()
+            db.session.rollback()
+        assert client.get('/api/v1/orders/summary?user_id=1').get_json() == first
+
+        client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2})
+        second = client.get('/api/v1/orders/summary?user_id=1').get_json()
+
+        assert first['totals']['orders'] == 1
+        assert second['totals'] == {'orders': 2, 'total': 30.0, 'by_status': {'pending': {'orders': 2, 'total': 30.0}}}
+
+    def test_create_order_idempotency_key_replays(self, client, product_service):
+        """Test a retried order with the same key returns the original response without new work"""
+        body = {'user_id': 1, 'product_id': 1, 'quantity': 2}
+        headers = {'Idempotency-Key': 'cart-42'}
+
+        first = client.post('/api/v1/orders', json=body, headers=headers)
+        calls_after_first = len(product_service)
+        idempotency_store.clear_cache()  # a replay served by another worker reads the DB
+        second = client.post('/api/v1/orders', json=body, headers=headers)
+        third = client.post('/api/v1/orders', json=body, headers=headers)
+
+        assert first.status_code == second.status_code == third.status_code == 201
+        assert second.get_json() == first.get_json() == third.get_json()
+        assert third.headers['Idempotent-Replayed'] == 'true'
+        assert len(product_service) == calls_after_first
+        with app.app_context():
+            assert Order.query.count() == 1
+
+        other = client.post('/api/v1/orders', json=dict(body, quantity=3), headers=headers)
+        assert other.status_code == 422
+
+    def test_create_order_idempotency_key_not_stored_on_error(self, client, product_service, monkeypatch):
+        """Test a failed attempt does not burn the key"""
+        def down(path, **kwargs):
+            raise requests.ConnectionError('product-service down')
+
+        monkeypatch.setattr(product_client, 'get', down)
+        body = {'user_id': 1, 'product_id': 1, 'quantity': 1}
+        assert client.post('/api/v1/orders', json=body, headers={'Idempotency-Key': 'k1'}).status_code == 503
+
+        monkeypatch.undo()
+        monkeypatch.setattr(stock_outbox, 'autostart', False)
+        monkeypatch.setattr(product_client, 'get', lambda path, **kw: FakeResponse(200, {'id': 1, 'price': 1.0, 'stock': 5}))
+        assert client.post('/api/v1/orders', json=body, headers={'Idempotency-Key': 'k1'}).status_code == 201
+
+    def test_get_orders_by_ids(self, client):
+        """Test orders are fetched in one batch and unknown ids are reported"""
+        with app.app_context():
+            for _ in range(2):
+                db.session.add(Order(user_id=1, product_id=1, quantity=1, total_price=10.0))
+            db.session.commit()
+
+        body = client.get('/api/v1/orders?ids=2,1,5').get_json()
+
+        assert [o['id'] for o in body['orders']] == [2, 1]
+        assert body['missing'] == [5]
+        assert client.get('/api/v1/orders').status_code == 400
+
+    def test_bulk_order_status_update(self, client, monkeypatch):
+        """Test bulk status changes report an outcome per order and apply in chunks"""
+        monkeypatch.setattr(order_app, 'STATUS_BATCH_CHUNK', 2)
+        with app.app_context():
+            for _ in range(3):
+                db.session.add(Order(user_id=1, product_id=1, quantity=1, total_price=10.0, status='pending'))
+            db.session.commit()
+
+        response = client.patch('/api/v1/orders/status', json={'updates': [
+            {'order_id': 1, 'status': 'shipped'},
+            {'order_id': 2, 'status': 'confirmed'},
+            {'order_id': 3, 'status': 'teleported'},
+            {'order_id': 99, 'status': 'shipped'}
+        ]})
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert {r['order_id']: r['outcome'] for r in body['results']} == {
+            1: 'updated', 2: 'updated', 3: 'invalid_status', 99: 'not_found'}
+        assert (body['updated'], body['failed']) == (2, 2)
+        statuses = [client.get(f'/api/v1/orders/{i}').get_json()['status'] for i in (1, 2, 3)]
+        assert statuses == ['shipped', 'confirmed', 'pending']
+
+    def test_bulk_order_status_enforces_transitions(self, client, product_service):
+        """Test bulk updates cannot reopen or cancel settled orders and release stock on cancel"""
+        with app.app_context():
+            for status in ('shipped', 'delivered', 'cancelled', 'confirmed'):
+                db.session.add(Order(user_id=1, product_id=1, quantity=2, total_price=20.0, status=status))
+            db.session.add(Order(user_id=1, product_id=3, quantity=1, total_price=2.5, status='pending',
+                                 intake_stage='queued'))
+            db.session.commit()
+
+        response = client.patch('/api/v1/orders/status', json={'updates': [
+            {'order_id': 1, 'status': 'cancelled'},
+            {'order_id': 2, 'status': 'pending'},
+            {'order_id': 3, 'status': 'pending'},
+            {'order_id': 4, 'status': 'cancelled'},
+            {'order_id': 5, 'status': 'cancelled'}
+        ]})
+
+        results = {r['order_id']: (r['outcome'], r.get('current_status')) for r in response.get_json()['results']}
+        assert results == {1: ('invalid_transition', 'shipped'), 2: ('invalid_transition', 'delivered'),
+                           3: ('invalid_transition', 'cancelled'), 4: ('updated', None), 5: ('updated', None)}
+        with app.app_context():
+            # Only the confirmed order held stock; the queued async order never reserved any
+            assert [(row.order_id, row.product_id, row.quantity) for row in StockOutbox.query] == [(4, 1, 2)]
+            assert db.session.get(Order, 5).intake_stage == 'failed'
+
+    def test_order_status_enforces_transitions(self, client, product_service):
+        """Test the single-order status update moves forward only and releases stock on cancel"""
+        with app.app_context():
+            for status in ('delivered', 'confirmed'):
+                db.session.add(Order(user_id=1, product_id=1, quantity=2, total_price=20.0, status=status))
+            db.session.commit()
+
+        reopened = client.patch('/api/v1/orders/1/status', json={'status': 'pending'})
+        shipped = client.patch('/api/v1/orders/2/status', json={'status': 'shipped'})
+        backwards = client.patch('/api/v1/orders/2/status', json={'status': 'confirmed'})
+
+        assert (reopened.status_code, reopened.get_json()['current_status']) == (400, 'delivered')
+        assert (shipped.status_code, shipped.get_json()['order']['status']) == (200, 'shipped')
+        assert (backwards.status_code, backwards.get_json()['current_status']) == (400, 'shipped')
+        assert client.patch('/api/v1/orders/99/status', json={'status': 'shipped'}).status_code == 404
+
+        with app.app_context():
+            db.session.add(Order(user_id=1, product_id=1, quantity=3, total_price=30.0, status='pending'))
+            db.session.commit()
+        cancelled = client.patch('/api/v1/orders/3/status', json={'status': 'cancelled'})
+
+        assert cancelled.get_json()['order']['status'] == 'cancelled'
+        with app.app_context():
+            assert [(row.order_id, row.quantity) for row in StockOutbox.query] == [(3, 3)]
+
+    def test_create_order_async(self, client, product_service):
+        """Test async intake returns 202 and workers complete the order"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2},
+                               headers={'Prefer': 'respond-async'})
+
+        assert response.status_code == 202
+        status_url = response.get_json()['status_url']
+        assert response.headers['Location'] == status_url
+
+        order_intake.join()
+        order = client.get(status_url).get_json()
+        assert order['intake_stage'] == 'completed'
+        assert order['total_price'] == 20.0
+        assert order['payment_id'] == 'pay-1'
+        assert ('PATCH', '/api/v1/products/stock', {'items': [{'product_id': 1, 'quantity': -2}]}) in product_service
+
+    def test_create_order_async_insufficient_stock(self, client, product_service):
+        """Test async intake cancels an order that cannot be fulfilled"""
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 50},
+                               headers={'Prefer': 'respond-async'})
+        order_intake.join()
+
+        order = client.get(response.get_json()['status_url']).get_json()
+        assert order['status'] == 'cancelled'
+        assert order['status_reason'] == 'Insufficient stock'
+
+    def test_create_order_async_backpressure(self, client, product_service, monkeypatch):
+        """Test async intake answers 429 when the queue is full"""
+        monkeypatch.setattr(order_intake, 'full', lambda: True)
+
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 1},
+                               headers={'Prefer': 'respond-async'})
+
+        assert response.status_code == 429
+
+    def test_cancel_queued_async_order(self, client, product_service, monkeypatch):
+        """Test cancelling a queued async order releases nothing and the worker skips it"""
+        monkeypatch.setattr(order_intake, 'submit', lambda order_id: None)
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2},
+                               headers={'Prefer': 'respond-async'})
+        order_id = response.get_json()['order']['id']
+
+        response = client.post(f'/api/v1/orders/{order_id}/cancel')
+        assert response.status_code == 200
+        assert response.get_json()['order']['intake_stage'] == 'failed'
+
+        with app.app_context():
+            order_app._process_order(order_id)
+            assert StockOutbox.query.count() == 0
+        assert product_service == []
+
+    def test_cancel_during_async_reservation_releases_stock(self, client, product_service, monkeypatch):
+        """Test a cancel racing the reserve stage leaves exactly one stock release and no payment"""
+        monkeypatch.setattr(order_intake, 'submit', lambda order_id: None)
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2},
+                               headers={'Prefer': 'respond-async'})
+        order_id = response.get_json()['order']['id']
+        statuses = []
+
+        def patch_then_cancel(path, **kwargs):
+            product_service.append(('PATCH', path, kwargs.get('json')))
+            cancel = threading.Thread(target=lambda: statuses.append(
+                app.test_client().post(f'/api/v1/orders/{order_id}/cancel').status_code))
+            cancel.start()
+            cancel.join()
+            return FakeResponse(200, {})
+
+        monkeypatch.setattr(product_client, 'patch', patch_then_cancel)
+        with app.app_context():
+            order_app._process_order(order_id)
+            releases = [(row.product_id, row.quantity) for row in StockOutbox.query]
+        assert statuses == [200]
+        assert releases == [(1, 2)]
+        assert not any(call[0] == 'POST' for call in product_service)
+        order = client.get(f'/api/v1/orders/{order_id}').get_json()
+        assert (order['status'], order['intake_stage'], order['payment_id']) == ('cancelled', 'failed', None)
+
+    @pytest.mark.parametrize('applied', [True, False])
+    def test_async_reservation_timeout_releases_stock(self, client, product_service, monkeypatch, applied):
+        """Test a reserve that times out is resent with its key and released exactly once"""
+        monkeypatch.setattr(order_intake, 'submit', lambda order_id: None)
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2},
+                               headers={'Prefer': 'respond-async'})
+        order_id = response.get_json()['order']['id']
+        stock = {1: 5}
+        keys = set()
+        calls = []
+
+        def fake_patch(path, **kwargs):
+            key = kwargs['headers']['Idempotency-Key']
+            calls.append(key)
+            if key in keys:
+                return FakeResponse(200, {'duplicate': True})
+            if len(calls) == 1:
+                if applied:
+                    # product-service applied the decrement, the response was lost
+                    keys.add(key)
+                    stock[1] -= 2
+                raise requests.exceptions.ReadTimeout('read timed out')
+            keys.add(key)
+            for item in kwargs['json']['items']:
+                stock[item['product_id']] += item['quantity']
+            return FakeResponse(200, {})
+
+        monkeypatch.setattr(product_client, 'patch', fake_patch)
+        with app.app_context():
+            order_app._process_order(order_id)
+            assert stock_outbox.dispatch_pending() == 2
+        assert calls[:2] == [f'order-{order_id}-reserve'] * 2
+        assert stock == {1: 5}
+        order = client.get(f'/api/v1/orders/{order_id}').get_json()
+        assert (order['status'], order['intake_stage']) == ('cancelled', 'failed')
+        assert not any(call[0] == 'POST' for call in product_service)
+
+    def test_async_reservation_timeout_rejected_resend_drops_release(self, client, product_service, monkeypatch):
+        """Test a timed-out reserve that product-service then rejects is not released"""
+        monkeypatch.setattr(order_intake, 'submit', lambda order_id: None)
+        response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2},
+                               headers={'Prefer': 'respond-async'})
+        order_id = response.get_json()['order']['id']
+
+        def timeout(path, **kwargs):
+            raise requests.exceptions.ReadTimeout('read timed out')
+
+        def reject(path, **kwargs):
+            product_service.append(('PATCH', path, kwargs.get('json')))
+            return FakeResponse(400, {'error': 'Insufficient stock', 'product_id': 1})
+
+        with app.app_context():
+            monkeypatch.setattr(product_client, 'patch', timeout)
+            order_app._process_order(order_id)
+            monkeypatch.setattr(product_client, 'patch', reject)
+            assert stock_outbox.dispatch_pending() == 0
+            rows = sorted((row.quantity, row.status) for row in StockOutbox.query)
+        assert rows == [(-2, 'failed'), (2, 'failed')]
+        assert [call[2] for call in product_service if call[0] == 'PATCH'] == [
+            {'items': [{'product_id': 1, 'quantity': -2}]}
+        ]
+
+    def test_resume_intake_requeues_queued_orders(self, client, product_service, monkeypatch):
+        """Test queued async orders lost with the in-memory queue are picked up at startup"""
+        with monkeypatch.context() as patched:
+            patched.setattr(order_intake, 'submit', lambda order_id: None)
+            response = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 2},
+                                   headers={'Prefer': 'respond-async'})
+        status_url = response.get_json()['status_url']
+
+        with app.app_context():
+            assert order_app.resume_intake() == 1
+        order_intake.join()
+        assert client.get(status_url).get_json()['intake_stage'] == 'completed'
+
+    def test_client_retries_idempotent_requests(self, upstream):
+        """Test GET is retried on 503 and succeeds"""
+        base_url, state = upstream
+        state['failures'] = 2
+        service = ServiceClient('test-retry', base_url, backoff=0.001)
+
+        response = service.get('/')
+
+        assert response.status_code == 200
+        assert state['requests'] == 3
+
+    def test_client_does_not_retry_non_idempotent(self, upstream):
+        """Test PATCH is not retried on 503"""
+        base_url, state = upstream
+        state['failures'] = 1
+        service = ServiceClient('test-no-retry', base_url, backoff=0.001)
+
+        response = service.patch('/', json={})
+
+        assert response.status_code == 503
+        assert state['requests'] == 1
+
+    def test_circuit_breaker_fails_fast(self):
+        """Test the breaker opens after repeated failures and stops calling upstream"""
+        breaker = CircuitBreaker('test-breaker', failure_threshold=2, reset_timeout=60)
+        service = ServiceClient('test-breaker', 'http://127.0.0.1:9', max_retries=0, breaker=breaker)
+
+        for _ in range(2):
+            with pytest.raises(requests.ConnectionError):
+                service.get('/')
+
+        assert breaker.is_open
+        with pytest.raises(CircuitOpenError):
+            service.get('/')
+
+    def test_circuit_breaker_half_open_probe_not_stuck(self, monkeypatch):
+        """Test a half-open probe failing with any error frees the trial slot"""
+        breaker = CircuitBreaker('test-probe', failure_threshold=1, reset_timeout=0)
+        service = ServiceClient('test-probe', 'http://127.0.0.1:9', max_retries=0, breaker=breaker)
+        errors = [requests.TooManyRedirects('loop'), ValueError('bad body')]
+
+        def failing_request(method, url, **kwargs):
+            raise errors.pop(0)
+
+        breaker.record_failure()
+        monkeypatch.setattr(service.session, 'request', failing_request)
+        with pytest.raises(requests.TooManyRedirects):
+            service.get('/')
+        with pytest.raises(ValueError):
+            service.get('/')
+
+        assert breaker.is_open
+        assert breaker.allow()
+
+    def test_archive_delivered_orders(self, client, product_service, archive):
+        """Test old delivered orders move to the archive and lookups still find them"""
+        multi = client.post('/api/v1/orders', json={'user_id': 1, 'items': [{'product_id': 1, 'quantity': 2},
+                                                                            {'product_id': 3, 'quantity': 1}]})
+        single = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 1})
+        live = client.post('/api/v1/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 1})
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=400)
+        with app.app_context():
+            for i, order in enumerate(Order.query.order_by(Order.id)):
+                order.created_at = old + datetime.timedelta(minutes=i)
+                if i < 2:
+                    order.status = 'delivered'
+                    order.updated_at = old
+            db.session.commit()
+        order_ids = [r.get_json()['order']['id'] for r in (multi, single, live)]
+
+        response = client.post('/api/v1/orders/archive', json={'older_than_days': 365})
+
+        assert response.status_code == 200
+        assert response.get_json()['archived'] == 2
+        with app.app_context():
+            assert Order.query.count() == 1
+            assert order_app.OrderItem.query.count() == 0
+        archived = client.get(f'/api/v1/orders/{order_ids[0]}').get_json()
+        assert archived['status'] == 'delivered'
+        assert [item['product_id'] for item in archived['items']] == [1, 3]
+        batch = client.get(f'/api/v1/orders?ids={order_ids[1]},{order_ids[2]},999').get_json()
+        assert [o['id'] for o in batch['orders']] == order_ids[1:]
+        assert batch['missing'] == [999]
+
+        first = client.get('/api/v1/orders/user/1?limit=2')
+        second = client.get(f'/api/v1/orders/user/1?limit=2&cursor={first.headers["X-Next-Cursor"]}')
+        assert [o['id'] for o in first.get_json() + second.get_json()] == order_ids[::-1]
+
+    def test_archive_keeps_summary_totals(self, client, archive):
+        """Test archived orders still count in summaries, grouped and filtered by their day"""
+        old = datetime.datetime(2023, 1, 2, 15, 30)
+        with app.app_context():
+            for user_id, day, status, price in [(1, 0, 'delivered', 10.0), (1, 0, 'cancelled', 5.0),
+                                                (1, 1, 'delivered', 2.0), (2, 0, 'delivered', 1.0),
+                                                (1, 0, 'pending', 7.0)]:
+                db.session.add(Order(user_id=user_id, product_id=1, quantity=1, total_price=price, status=status,
+                                     created_at=old + datetime.timedelta(days=day), updated_at=old))
+            db.session.commit()
+        queries = ['/api/v1/orders/summary', '/api/v1/orders/summary?group_by=user,day',
+                   '/api/v1/orders/summary?group_by=week&user_id=1&status=delivered',
+                   '/api/v1/orders/summary?since=2023-01-03&until=2023-01-04']
+        before = [client.get(query).get_json() for query in queries]
+
+        response = client.post('/api/v1/orders/archive', json={'older_than_days': 365})
+
+        assert response.get_json()['archived'] == 4
+        with app.app_context():
+            assert Order.query.count() == 1
+        assert [client.get(query).get_json() for query in queries] == before
+        assert before[0]['totals']['orders'] == 5
+        assert before[3]['totals'] == {'orders': 1, 'total': 2.0, 'by_status': {'delivered': {'orders': 1, 'total': 2.0}}}
+
+    def test_archive_requires_archive_dir(self, client, monkeypatch):
+        """Test archiving is refused when no archive volume is configured"""
+        monkeypatch.setattr(order_app, 'order_archive', Archive(None, 'orders', sort_key='user_id', lookup_keys=('id',)))
+
+        response = client.post('/api/v1/orders/archive', json={'older_than_days': 1})
+
+        assert response.status_code == 503
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
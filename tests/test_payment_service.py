@@ -0,0 +1,272 @@
+import datetime
+import json
+import pytest
+import reconcile
+import app as payment_app
+from archive import Archive
+from app import app, db, Payment, idempotency_store, payment_gateway, payment_processor, payment_cache
+from gateway import PaymentGateway, StubGateway
+
+@pytest.fixture
+def always_approve(monkeypatch):
+    """Make the stub gateway approve every payment"""
+    monkeypatch.setattr(payment_gateway, 'failure_rate', 0.0)
+
+def create_payments(client, count):
+    return [client.post('/api/v1/payments', json={'order_id': i, 'user_id': 1, 'amount': 10.0})
+            .get_json()['payment']['payment_id'] for i in range(count)]
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """Point the payment archive at an empty temporary directory"""
+    archive = Archive(str(tmp_path), 'payments', sort_key='user_id', lookup_keys=('payment_id', 'order_id'), block_rows=2)
+    monkeypatch.setattr(payment_app, 'payment_archive', archive)
+    return archive
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    idempotency_store.clear_cache()
+    payment_cache.clear()
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+        with app.app_context():
+            db.drop_all()
+
+class TestPaymentService:
+    """Test cases for Payment Service"""
+
+    def test_health_check(self, client):
+        """Test health endpoint"""
+        response = client.get('/health')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'healthy'
+
+    def test_create_payment(self, client):
+        """Test payment creation"""
+        response = client.post('/api/v1/payments', json={'order_id': 1, 'user_id': 1, 'amount': 20.0})
+
+        assert response.status_code == 201
+        assert response.get_json()['payment']['status'] == 'pending'
+
+    def test_create_payment_idempotency_key(self, client):
+        """Test a retried payment with the same key creates one payment"""
+        body = {'order_id': 7, 'user_id': 1, 'amount': 20.0}
+        headers = {'Idempotency-Key': 'order-7'}
+
+        first = client.post('/api/v1/payments', json=body, headers=headers)
+        second = client.post('/api/v1/payments', json=body, headers=headers)
+
+        assert second.status_code == 201
+        assert second.get_json()['payment']['payment_id'] == first.get_json()['payment']['payment_id']
+        with app.app_context():
+            assert Payment.query.count() == 1
+
+    def test_process_payment_through_gateway(self, client, always_approve):
+        """Test synchronous processing settles through the gateway and cannot run twice"""
+        payment_id = create_payments(client, 1)[0]
+
+        response = client.post(f'/api/v1/payments/{payment_id}/process')
+
+        assert response.status_code == 200
+        payment = response.get_json()['payment']
+        assert payment['status'] == 'completed'
+        assert payment['transaction_id'].startswith('TXN-')
+        assert client.post(f'/api/v1/payments/{payment_id}/process').status_code == 400
+        assert client.post('/api/v1/payments/missing/process').status_code == 404
+
+    def test_process_batch_settles_in_worker_pool(self, client, always_approve):
+        """Test a batch is claimed at once, queued and settled by the workers"""
+        payment_ids = create_payments(client, 3)
+        client.post(f'/api/v1/payments/{payment_ids[0]}/process')
+
+        response = client.post('/api/v1/payments/process-batch', json={'payment_ids': payment_ids + ['missing']})
+
+        assert response.status_code == 202
+        assert [r['outcome'] for r in response.get_json()['results']] == ['not_pending', 'queued', 'queued', 'not_found']
+        payment_processor.join()
+        statuses = [client.get(f'/api/v1/payments/{p}').get_json()['status'] for p in payment_ids]
+        assert statuses == ['completed'] * 3
+
+    def test_resume_requeues_stuck_processing_payments(self, client, always_approve):
+        """Test payments left in processing by a dead worker are settled again after resume_after"""
+        stuck, fresh = create_payments(client, 2)
+        with app.app_context():
+            payment_processor.claim([stuck, fresh])
+            Payment.query.filter_by(payment_id=stuck).update(
+                {'updated_at': datetime.datetime.utcnow() - datetime.timedelta(hours=1)})
+            db.session.commit()
+
+            assert payment_processor.resume() == 1
+        payment_processor.join()
+
+        assert client.get(f'/api/v1/payments/{stuck}').get_json()['status'] == 'completed'
+        assert client.get(f'/api/v1/payments/{fresh}').get_json()['status'] == 'processing'
+
+    def test_stub_gateway_failure_rate(self):
+        """Test the stub declines roughly the configured share of payments"""
+        gateway = StubGateway(failure_rate=0.3, seed=1)
+
+        declined = sum(not gateway.charge({}).success for _ in range(2000))
+
+        assert 500 < declined < 700
+
+    def test_gateway_interface_is_abstract(self):
+        """Test a gateway without charge() cannot be instantiated"""
+        class Incomplete(PaymentGateway):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_reconciliation_streams_discrepancies(self, client, monkeypatch):
+        """Test payments are merge-joined with orders and discrepancies streamed as NDJSON"""
+        orders = {1: {'id': 1, 'user_id': 1, 'status': 'pending', 'total_price': 10.0},
+                  2: {'id': 2, 'user_id': 1, 'status': 'cancelled', 'total_price': 10.0},
+                  3: {'id': 3, 'user_id': 2, 'status': 'pending', 'total_price': 12.0}}
+        fetched = []
+
+        class FakeFetcher:
+            def __init__(self, base_url):
+                pass
+
+            def __call__(self, order_ids):
+                fetched.append(order_ids)
+                return [orders[i] for i in order_ids if i in orders]
+
+            def close(self):
+                pass
+
+        monkeypatch.setattr(reconcile, 'OrderFetcher', FakeFetcher)
+        with app.app_context():
+            for order_id, status in [(3, 'completed'), (1, 'completed'), (2, 'completed'), (4, 'pending'), (2, 'refunded')]:
+                db.session.add(Payment(payment_id=f'pay-{order_id}-{status}', order_id=order_id, user_id=1,
+                                       amount=10.0, status=status))
+            db.session.commit()
+
+        response = client.get('/api/v1/payments/reconciliation?chunk_size=2&progress_every=2')
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+        found = sorted((e['order_id'], e['kind']) for e in events if e['type'] == 'discrepancy')
+        assert found == [(2, 'completed_payment_on_cancelled_order'), (3, 'amount_mismatch'),
+                         (3, 'user_mismatch'), (4, 'order_missing')]
+        assert fetched == [[1, 2], [2, 3], [4]]
+        assert [e['payments'] for e in events if e['type'] == 'progress'] == [2, 4]
+        assert events[-1]['type'] == 'summary' and events[-1]['payments'] == 5
+
+    def test_payments_by_order_ids(self, client):
+        """Test one entry per order, the latest payment wins and unknown orders map to null"""
+        with app.app_context():
+            for payment_id, order_id, status in [('a', 1, 'failed'), ('b', 1, 'completed'), ('c', 2, 'pending')]:
+                db.session.add(Payment(payment_id=payment_id, order_id=order_id, user_id=1, amount=1.0, status=status))
+            db.session.commit()
+
+        body = client.get('/api/v1/payments?order_ids=1,2,3').get_json()
+
+        assert {k: v and v['payment_id'] for k, v in body['payments'].items()} == {'1': 'b', '2': 'c', '3': None}
+        assert client.get('/api/v1/payments/order/1').get_json()['payment_id'] == 'b'
+
+    def test_payment_cache_holds_only_final_payments(self, client):
+        """Test completed payments are served from cache and refunds invalidate them"""
+        with app.app_context():
+            db.session.add(Payment(payment_id='done', order_id=1, user_id=1, amount=1.0, status='completed'))
+            db.session.add(Payment(payment_id='open', order_id=2, user_id=1, amount=1.0, status='pending'))
+            db.session.commit()
+        client.get('/api/v1/payments?order_ids=1,2')
+
+        with app.app_context():
+            Payment.query.update({'amount': 5.0})
+            db.session.commit()
+        body = client.get('/api/v1/payments?order_ids=1,2').get_json()
+        assert body['payments']['1']['amount'] == 1.0
+        assert body['payments']['2']['amount'] == 5.0
+
+        client.post('/api/v1/payments/done/refund')
+        assert client.get('/api/v1/payments/order/1').get_json()['status'] == 'refunded'
+
+    def test_user_payments_keyset_pagination(self, client):
+        """Test user payment history is newest first, filtered in SQL and paged by cursor"""
+        start = datetime.datetime(2024, 1, 1)
+        with app.app_context():
+            for day in range(5):
+                db.session.add(Payment(payment_id=f'pay-{day}', order_id=day, user_id=1, amount=10.0,
+                                       status='failed' if day == 1 else 'completed',
+                                       created_at=start + datetime.timedelta(days=day)))
+            db.session.commit()
+
+        first = client.get('/api/v1/payments/user/1?limit=3&status=completed')
+        second = client.get(f"/api/v1/payments/user/1?limit=3&status=completed&cursor={first.headers['X-Next-Cursor']}")
+
+        ids = [p['payment_id'] for p in first.get_json() + second.get_json()]
+        assert ids == ['pay-4', 'pay-3', 'pay-2', 'pay-0']
+        assert 'X-Next-Cursor' not in second.headers
+        assert client.get('/api/v1/payments/user/1?cursor=garbage').status_code == 400
+
+    def test_archive_settled_payments(self, client, archive):
+        """Test old settled payments move to the archive and lookups still find them"""
+        payment_ids = create_payments(client, 5)
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=400)
+        with app.app_context():
+            for i, payment in enumerate(Payment.query.order_by(Payment.id)):
+                payment.created_at = old + datetime.timedelta(minutes=i)
+                if i < 3:
+                    payment.status = 'completed'
+                    payment.updated_at = old
+            db.session.commit()
+
+        response = client.post('/api/v1/payments/archive', json={'older_than_days': 365})
+
+        assert response.status_code == 200
+        assert response.get_json()['archived'] == 3
+        assert response.get_json()['archive']['segments'] == 1
+        with app.app_context():
+            assert Payment.query.count() == 2
+        assert client.get(f'/api/v1/payments/{payment_ids[0]}').get_json()['status'] == 'completed'
+        assert client.get('/api/v1/payments/order/1').get_json()['payment_id'] == payment_ids[1]
+        payments = client.get('/api/v1/payments?order_ids=2,3,99').get_json()['payments']
+        assert payments['2']['payment_id'] == payment_ids[2]
+        assert payments['3']['payment_id'] == payment_ids[3]
+        assert payments['99'] is None
+        assert client.get('/api/v1/payments/missing').status_code == 404
+
+        # History pages merge live and archived payments newest first
+        first = client.get('/api/v1/payments/user/1?limit=3')
+        second = client.get(f'/api/v1/payments/user/1?limit=3&cursor={first.headers["X-Next-Cursor"]}')
+        history = [p['payment_id'] for p in first.get_json() + second.get_json()]
+        assert history == payment_ids[::-1]
+        assert 'X-Next-Cursor' not in second.headers
+
+        # A second run finds nothing left to move
+        assert client.post('/api/v1/payments/archive', json={'older_than_days': 365}).get_json()['archived'] == 0
+
+    def test_archive_recovers_interrupted_run(self, client, archive):
+        """Test rows left behind by an interrupted run are deleted without archiving them twice"""
+        create_payments(client, 2)
+        with app.app_context():
+            Payment.query.update({'status': 'failed', 'updated_at': datetime.datetime(2020, 1, 1)})
+            db.session.commit()
+            archive.write_segment([p.to_dict() for p in Payment.query.order_by(Payment.id)], pending=True)
+
+            result = payment_app.archive_settled(30)
+
+            assert result['recovered'] == 2
+            assert result['archived'] == 0
+            assert Payment.query.count() == 0
+        assert archive.pending_segments() == []
+        assert len(archive.find('user_id', 1)) == 2
+
+    def test_archive_requires_archive_dir(self, client, monkeypatch):
+        """Test archiving is refused when no archive volume is configured"""
+        monkeypatch.setattr(payment_app, 'payment_archive', Archive(None, 'payments', sort_key='user_id', lookup_keys=('id',)))
+
+        response = client.post('/api/v1/payments/archive', json={'older_than_days': 1})
+
+        assert response.status_code == 503
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
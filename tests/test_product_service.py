@@ -0,0 +1,254 @@
+import json
+import threading
+import time
+import pytest
+from prometheus_client import CollectorRegistry
+from app import app, db, Product, ProductImport, product_counts, product_cache
+from product_cache import ProductCache
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app"""
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    product_counts.invalidate()
+    product_cache.clear()
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+        with app.app_context():
+            db.drop_all()
+
+@pytest.fixture
+def product_ids(client):
+    """Create a couple of products with known stock"""
+    ids = []
+    for name, stock in [('Laptop', 10), ('Mouse', 5)]:
+        response = client.post('/api/v1/products', json={
+            'name': name,
+            'price': 10.0,
+            'stock': stock,
+            'category': 'electronics'
+        })
+        ids.append(response.get_json()['product']['id'])
+    return ids
+
+class TestProductService:
+    """Test cases for Product Service"""
+
+    def test_health_check(self, client):
+        """Test health endpoint"""
+        response = client.get('/health')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'healthy'
+
+    def test_update_stock(self, client, product_ids):
+        """Test conditional stock decrement"""
+        response = client.patch(f'/api/v1/products/{product_ids[0]}/stock', json={'quantity': -3})
+
+        assert response.status_code == 200
+        assert response.get_json()['product']['stock'] == 7
+
+    def test_update_stock_insufficient(self, client, product_ids):
+        """Test decrement below zero is rejected and stock is unchanged"""
+        response = client.patch(f'/api/v1/products/{product_ids[1]}/stock', json={'quantity': -6})
+        assert response.status_code == 400
+
+        response = client.get(f'/api/v1/products/{product_ids[1]}')
+        assert response.get_json()['stock'] == 5
+
+    def test_update_stock_missing_product(self, client):
+        """Test stock update on a product that does not exist"""
+        response = client.patch('/api/v1/products/999/stock', json={'quantity': 1})
+        assert response.status_code == 404
+
+    def test_batch_stock_update(self, client, product_ids):
+        """Test batch stock update applies all deltas"""
+        response = client.patch('/api/v1/products/stock', json={'items': [
+            {'product_id': product_ids[0], 'quantity': -2},
+            {'product_id': product_ids[1], 'quantity': -1},
+            {'product_id': product_ids[0], 'quantity': -1}
+        ]})
+
+        assert response.status_code == 200
+        stock = {p['id']: p['stock'] for p in response.get_json()['products']}
+        assert stock == {product_ids[0]: 7, product_ids[1]: 4}
+
+    def test_batch_stock_update_all_or_nothing(self, client, product_ids):
+        """Test one failing item rolls back the whole batch"""
+        response = client.patch('/api/v1/products/stock', json={'items': [
+            {'product_id': product_ids[0], 'quantity': -2},
+            {'product_id': product_ids[1], 'quantity': -50}
+        ]})
+
+        assert response.status_code == 400
+        assert response.get_json()['product_id'] == product_ids[1]
+        assert client.get(f'/api/v1/products/{product_ids[0]}').get_json()['stock'] == 10
+
+    def test_batch_stock_update_idempotency_key(self, client, product_ids):
+        """Test a redelivered batch with the same Idempotency-Key is applied once"""
+        body = {'items': [{'product_id': product_ids[0], 'quantity': -2}]}
+        headers = {'Idempotency-Key': 'batch-1'}
+
+        first = client.patch('/api/v1/products/stock', json=body, headers=headers)
+        second = client.patch('/api/v1/products/stock', json=body, headers=headers)
+
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert second.get_json()['duplicate'] is True
+        assert client.get(f'/api/v1/products/{product_ids[0]}').get_json()['stock'] == 8
+
+    def test_get_products_by_ids(self, client, product_ids):
+        """Test products are fetched in one batch and unknown ids are reported"""
+        response = client.get(f'/api/v1/products?ids={product_ids[1]},{product_ids[0]},999')
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert [p['id'] for p in body['products']] == [product_ids[1], product_ids[0]]
+        assert body['missing'] == [999]
+
+    def test_list_products_cursor_pagination(self, client):
+        """Test keyset pagination walks a category without overlap"""
+        for i in range(5):
+            client.post('/api/v1/products', json={'name': f'Book {i}', 'price': 1.0, 'category': 'books'})
+            client.post('/api/v1/products', json={'name': f'Toy {i}', 'price': 1.0, 'category': 'toys'})
+
+        first = client.get('/api/v1/products?category=books&per_page=3').get_json()
+        assert first['total'] == 5
+        assert first['next_cursor']
+
+        second = client.get(f"/api/v1/products?category=books&per_page=3&cursor={first['next_cursor']}").get_json()
+        names = [p['name'] for p in first['products'] + second['products']]
+        assert names == [f'Book {i}' for i in range(5)]
+        assert second['next_cursor'] is None
+
+    def test_list_products_cursor_category_mismatch(self, client, product_ids):
+        """Test a cursor cannot be reused with another category filter"""
+        first = client.get('/api/v1/products?category=electronics&per_page=1').get_json()
+
+        response = client.get(f"/api/v1/products?category=books&cursor={first['next_cursor']}")
+        assert response.status_code == 400
+
+    def test_list_products_exact_count(self, client, product_ids):
+        """Test exact count on request and cached count adjusted on create"""
+        assert client.get('/api/v1/products').get_json()['total'] == 2
+        client.post('/api/v1/products', json={'name': 'Cable', 'price': 1.0, 'category': 'electronics'})
+
+        assert client.get('/api/v1/products?category=electronics').get_json()['total'] == 3
+        data = client.get('/api/v1/products?exact_count=true').get_json()
+        assert data['total'] == 3
+        assert data['total_is_exact'] is True
+
+    def test_get_product_etag_not_modified(self, client, product_ids):
+        """Test repeat reads with If-None-Match get 304 without a body"""
+        first = client.get(f'/api/v1/products/{product_ids[0]}')
+        assert first.status_code == 200
+        etag = first.headers['ETag']
+
+        response = client.get(f'/api/v1/products/{product_ids[0]}', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.get_data() == b''
+
+    def test_product_cache_invalidated_on_stock_update(self, client, product_ids):
+        """Test stock changes are visible immediately and change the ETag"""
+        first = client.get(f'/api/v1/products/{product_ids[0]}')
+        client.patch(f'/api/v1/products/{product_ids[0]}/stock', json={'quantity': -4})
+
+        response = client.get(f'/api/v1/products/{product_ids[0]}', headers={'If-None-Match': first.headers['ETag']})
+        assert response.status_code == 200
+        assert response.get_json()['stock'] == 6
+
+    def test_product_cache_coalesces_concurrent_misses(self):
+        """Test concurrent misses for one id run the loader once"""
+        cache = ProductCache(registry=CollectorRegistry())
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            time.sleep(0.1)
+            return {'id': key}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(1, loader))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert len(results) == 8
+        assert all(result[0] == {'id': 1} for result in results)
+
+    def test_import_products_upserts_by_sku(self, client):
+        """Test NDJSON import inserts new SKUs, updates existing ones and reports bad rows"""
+        client.post('/api/v1/products', json={'name': 'Old name', 'price': 1.0, 'sku': 'SKU-1'})
+        body = '\n'.join([
+            json.dumps({'sku': 'SKU-1', 'name': 'New name', 'price': 2.5, 'stock': 3}),
+            json.dumps({'sku': 'SKU-2', 'name': 'Second', 'price': 1.0}),
+            json.dumps({'sku': 'SKU-3', 'price': 1.0}),
+        ])
+
+        response = client.post('/api/v1/products/import', data=body, content_type='application/x-ndjson')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['upserted'] == 2
+        assert data['errors'] == [{'row': 3, 'error': 'Missing fields: name'}]
+        with app.app_context():
+            product = Product.query.filter_by(sku='SKU-1').one()
+            assert (product.name, product.price, product.stock) == ('New name', 2.5, 3)
+            assert Product.query.count() == 2
+
+    def test_import_products_resumes_from_checkpoint(self, client):
+        """Test resending a file with an import_id skips rows already committed"""
+        with app.app_context():
+            db.session.add(ProductImport(id='job-1', rows_committed=2, status='running'))
+            db.session.commit()
+        body = 'sku,name,price\nA,First,1\nB,Second,1\nC,Third,1\n'
+
+        response = client.post('/api/v1/products/import?import_id=job-1', data=body, content_type='text/csv')
+
+        assert response.status_code == 200
+        assert response.get_json()['resumed_from'] == 2
+        with app.app_context():
+            assert [p.sku for p in Product.query.all()] == ['C']
+            assert db.session.get(ProductImport, 'job-1').status == 'completed'
+
+    def test_export_products(self, client, product_ids):
+        """Test NDJSON and CSV export stream the whole catalogue"""
+        response = client.get('/api/v1/products/export')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [r['id'] for r in rows] == product_ids
+
+        response = client.get('/api/v1/products/export?format=csv')
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0].startswith('id,sku,name')
+        assert len(lines) == 3
+
+    def test_search_products_ranked_prefix(self, client):
+        """Test search matches word prefixes and ranks name matches first"""
+        client.post('/api/v1/products', json={'name': 'USB cable', 'description': 'Works with any laptop', 'price': 5.0})
+        client.post('/api/v1/products', json={'name': 'Gaming laptop', 'description': 'Fast', 'price': 999.0})
+        client.post('/api/v1/products', json={'name': 'Desk lamp', 'price': 20.0})
+
+        response = client.get('/api/v1/products/search?q=lapt')
+
+        assert response.status_code == 200
+        names = [p['name'] for p in response.get_json()['products']]
+        assert names == ['Gaming laptop', 'USB cable']
+
+    def test_search_index_follows_updates_and_deletes(self, client):
+        """Test the text index is kept in sync with product writes"""
+        product_id = client.post('/api/v1/products', json={'name': 'Blue mug', 'price': 5.0}).get_json()['product']['id']
+        client.put(f'/api/v1/products/{product_id}', json={'name': 'Red mug'})
+
+        assert client.get('/api/v1/products/search?q=blue').get_json()['products'] == []
+        assert len(client.get('/api/v1/products/search?q=red mug').get_json()['products']) == 1
+
+        client.delete(f'/api/v1/products/{product_id}')
+        assert client.get('/api/v1/products/search?q=red').get_json()['products'] == []
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
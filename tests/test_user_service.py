@@ -1,11 +1,15 @@
+import datetime
+import json
 import pytest
-from app import app, db, User
+from app import app, db, User, ImportJob, password_hasher, token_verifier, metrics, profile_cache, bulk_importer
+from werkzeug.security import generate_password_hash
 
 @pytest.fixture
 def client():
     """Create a test client for the Flask app"""
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    profile_cache.clear()
     
     with app.test_client() as client:
         with app.app_context():
@@ -132,6 +136,308 @@ class TestUserService:
         assert response.status_code == 200
         data = response.get_json()
         assert len(data) >= 3
+    
+    def test_login_rehashes_outdated_password_hash(self, client):
+        """Test login upgrades a hash computed with an old cost"""
+        client.post('/api/v1/users/register', json={
+            'username': 'rehash',
+            'email': 'rehash@example.com',
+            'password': 'password123'
+        })
+        with app.app_context():
+            user = User.query.filter_by(username='rehash').first()
+            user.password_hash = generate_password_hash('password123', 'pbkdf2:sha256:1000')
+            db.session.commit()
+        
+        response = client.post('/api/v1/users/login', json={
+            'username': 'rehash',
+            'password': 'password123'
+        })
+        
+        assert response.status_code == 200
+        with app.app_context():
+            user = User.query.filter_by(username='rehash').first()
+            assert user.password_hash.startswith(password_hasher.method + '$')
+    
+    def test_register_sheds_load_when_hash_queue_full(self, client, monkeypatch):
+        """Test registration returns 503 when the hashing pool is saturated"""
+        monkeypatch.setattr(password_hasher, 'queue_limit', 0)
+        
+        response = client.post('/api/v1/users/register', json={
+            'username': 'busy',
+            'email': 'busy@example.com',
+            'password': 'password123'
+        })
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    
+    def test_refresh_token_rotation(self, client):
+        """Test refresh issues a new pair and the old refresh token stops working"""
+        client.post('/api/v1/users/register', json={
+            'username': 'refresher',
+            'email': 'refresher@example.com',
+            'password': 'password123'
+        })
+        login = client.post('/api/v1/users/login', json={
+            'username': 'refresher',
+            'password': 'password123'
+        }).get_json()
+        assert 'refresh_token' in login
+        
+        response = client.post('/api/v1/users/token/refresh', json={
+            'refresh_token': login['refresh_token']
+        })
+        
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['token']
+        assert data['refresh_token'] != login['refresh_token']
+        
+        replay = client.post('/api/v1/users/token/refresh', json={
+            'refresh_token': login['refresh_token']
+        })
+        assert replay.status_code == 401
+    
+    def test_refresh_token_invalid(self, client):
+        """Test refresh with an unknown token"""
+        response = client.post('/api/v1/users/token/refresh', json={
+            'refresh_token': 'not-a-real-token'
+        })
+        
+        assert response.status_code == 401
+    
+    def test_verify_token(self, client, auth_headers):
+        """Test token verification and that repeat checks hit the cache"""
+        token_verifier.clear()
+        
+        response = client.get('/api/v1/users/verify', headers=auth_headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['valid'] is True
+        assert data['username'] == 'testuser'
+        
+        hits = metrics.registry.get_sample_value('jwt_verify_cache_total', {'result': 'hit'}) or 0
+        response = client.get('/api/v1/users/verify', headers=auth_headers)
+        assert response.status_code == 200
+        assert metrics.registry.get_sample_value('jwt_verify_cache_total', {'result': 'hit'}) == hits + 1
+    
+    def test_verify_invalid_token(self, client):
+        """Test verification rejects missing and forged tokens"""
+        response = client.get('/api/v1/users/verify')
+        assert response.status_code == 401
+        
+        response = client.get('/api/v1/users/verify', headers={'Authorization': 'Bearer forged.token.value'})
+        assert response.status_code == 401
+        assert response.get_json()['valid'] is False
+    
+    def test_get_users_keyset_pagination(self, client):
+        """Test users are paged by cursor with a bounded limit"""
+        for i in range(5):
+            client.post('/api/v1/users/register', json={
+                'username': f'page{i}',
+                'email': f'page{i}@example.com',
+                'password': 'password123'
+            })
+        
+        first = client.get('/api/v1/users?limit=3')
+        assert first.status_code == 200
+        assert len(first.get_json()) == 3
+        cursor = first.headers['X-Next-Cursor']
+        
+        second = client.get(f'/api/v1/users?limit=3&cursor={cursor}')
+        assert second.status_code == 200
+        usernames = [u['username'] for u in first.get_json() + second.get_json()]
+        assert usernames == [f'page{i}' for i in range(5)]
+        assert 'X-Next-Cursor' not in second.headers
+        assert client.get('/api/v1/users?cursor=abc').status_code == 400
+        assert client.get('/api/v1/users?limit=ten').status_code == 400
+    
+    def test_get_users_ndjson_stream_with_fields(self, client):
+        """Test NDJSON streaming mode with field projection"""
+        for i in range(3):
+            client.post('/api/v1/users/register', json={
+                'username': f'stream{i}',
+                'email': f'stream{i}@example.com',
+                'password': 'password123'
+            })
+        
+        response = client.get('/api/v1/users?format=ndjson&fields=username')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert rows == [{'username': f'stream{i}'} for i in range(3)]
+    
+    def test_get_users_unknown_field(self, client):
+        """Test projection rejects fields that are not exposed"""
+        response = client.get('/api/v1/users?fields=password_hash')
+        assert response.status_code == 400
+    
+    def test_get_users_by_ids(self, client):
+        """Test batch lookup returns requested users in request order"""
+        ids = []
+        for i in range(3):
+            response = client.post('/api/v1/users/register', json={
+                'username': f'batch{i}',
+                'email': f'batch{i}@example.com',
+                'password': 'password123'
+            })
+            ids.append(response.get_json()['user']['id'])
+        
+        response = client.get(f'/api/v1/users?ids={ids[2]},{ids[0]},99999')
+        
+        assert response.status_code == 200
+        assert [u['username'] for u in response.get_json()] == ['batch2', 'batch0']
+    
+    def test_profile_cache_invalidated_on_write(self, client):
+        """Test cached profiles are served until the user row changes"""
+        response = client.post('/api/v1/users/register', json={
+            'username': 'cached',
+            'email': 'cached@example.com',
+            'password': 'password123'
+        })
+        user_id = response.get_json()['user']['id']
+        
+        assert client.get(f'/api/v1/users/{user_id}').get_json()['email'] == 'cached@example.com'
+        hits = metrics.registry.get_sample_value('user_profile_cache_requests_total', {'result': 'hit'}) or 0
+        client.get(f'/api/v1/users/{user_id}')
+        assert metrics.registry.get_sample_value('user_profile_cache_requests_total', {'result': 'hit'}) == hits + 1
+        
+        with app.app_context():
+            user = db.session.get(User, user_id)
+            user.email = 'changed@example.com'
+            db.session.commit()
+        
+        assert client.get(f'/api/v1/users/{user_id}').get_json()['email'] == 'changed@example.com'
+
+    def test_profile_cache_invalidated_after_commit(self, client):
+        """Test a flushed but uncommitted write keeps the cached profile until commit"""
+        response = client.post('/api/v1/users/register', json={
+            'username': 'pending',
+            'email': 'pending@example.com',
+            'password': 'password123'
+        })
+        user_id = response.get_json()['user']['id']
+        client.get(f'/api/v1/users/{user_id}')
+        loads = []
+
+        def loader(ids):
+            loads.append(ids)
+            return {}
+
+        with app.app_context():
+            user = db.session.get(User, user_id)
+            user.email = 'rolledback@example.com'
+            db.session.flush()
+            assert profile_cache.get_many([user_id], loader)[user_id]['email'] == 'pending@example.com'
+            db.session.rollback()
+            assert profile_cache.get_many([user_id], loader)[user_id]['email'] == 'pending@example.com'
+
+            user = db.session.get(User, user_id)
+            user.email = 'committed@example.com'
+            db.session.commit()
+
+        assert loads == []
+        assert client.get(f'/api/v1/users/{user_id}').get_json()['email'] == 'committed@example.com'
+
+    def test_profile_cache_skips_load_invalidated_in_flight(self):
+        """Test a profile loaded before a concurrent invalidation is returned but not cached"""
+        calls = []
+
+        def loader(ids):
+            calls.append(ids)
+            if len(calls) == 1:
+                # A write commits while this load is still reading the old row
+                profile_cache.invalidate(42)
+            return {42: {'id': 42, 'email': f'v{len(calls)}@example.com'}}
+
+        assert profile_cache.get_many([42], loader)[42]['email'] == 'v1@example.com'
+        assert profile_cache.get_many([42], loader)[42]['email'] == 'v2@example.com'
+        assert profile_cache.get_many([42], loader)[42]['email'] == 'v2@example.com'
+        assert len(calls) == 2
+
+    def test_register_duplicate_email(self, client):
+        """Test registration with duplicate email"""
+        client.post('/api/v1/users/register', json={
+            'username': 'first',
+            'email': 'same@example.com',
+            'password': 'password123'
+        })
+        
+        response = client.post('/api/v1/users/register', json={
+            'username': 'second',
+            'email': 'same@example.com',
+            'password': 'password123'
+        })
+        
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Email already exists'
+    
+    def test_bulk_import_ndjson(self, client):
+        """Test NDJSON bulk import with a per-row error report"""
+        client.post('/api/v1/users/register', json={
+            'username': 'existing',
+            'email': 'existing@example.com',
+            'password': 'password123'
+        })
+        body = '\n'.join([
+            json.dumps({'username': 'bulk1', 'email': 'bulk1@example.com', 'password': 'pw1'}),
+            json.dumps({'username': 'existing', 'email': 'other@example.com', 'password': 'pw2'}),
+            'not json',
+            json.dumps({'username': 'bulk2', 'email': 'bulk2@example.com'}),
+            json.dumps({'username': 'bulk3', 'email': 'bulk3@example.com', 'password': 'pw3'}),
+        ])
+        
+        response = client.post('/api/v1/users/bulk', data=body, content_type='application/x-ndjson')
+        
+        assert response.status_code == 202
+        assert response.headers['Location'] == response.get_json()['status_url']
+        bulk_importer.join()
+        data = client.get(response.get_json()['status_url']).get_json()
+        assert data['status'] == 'completed'
+        assert data['total'] == 5
+        assert data['inserted'] == 2
+        assert data['failed'] == 3
+        assert sorted(e['row'] for e in data['errors']) == [2, 3, 4]
+        login = client.post('/api/v1/users/login', json={'username': 'bulk3', 'password': 'pw3'})
+        assert login.status_code == 200
+    
+    def test_bulk_import_csv(self, client):
+        """Test CSV bulk import"""
+        body = 'username,email,password\ncsv1,csv1@example.com,pw\ncsv2,csv2@example.com,pw\n'
+        
+        response = client.post('/api/v1/users/bulk', data=body, content_type='text/csv')
+        
+        assert response.status_code == 202
+        bulk_importer.join()
+        assert client.get(response.get_json()['status_url']).get_json()['inserted'] == 2
+    
+    def test_bulk_import_row_limit(self, client):
+        """Test an import over BULK_IMPORT_MAX_ROWS is refused before any job is created"""
+        app.config['BULK_IMPORT_MAX_ROWS'] = 2
+        try:
+            body = 'username,email,password\n' + ''.join(f'u{i},u{i}@example.com,pw\n' for i in range(3))
+            response = client.post('/api/v1/users/bulk', data=body, content_type='text/csv')
+        finally:
+            app.config['BULK_IMPORT_MAX_ROWS'] = 10000
+        
+        assert response.status_code == 413
+        with app.app_context():
+            assert ImportJob.query.count() == 0
+    
+    def test_bulk_import_reports_interrupted_job(self, client):
+        """Test a job whose worker stopped heartbeating is reported as failed"""
+        with app.app_context():
+            db.session.add(ImportJob(id='lost-job', status='running', total=10,
+                                     updated_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)))
+            db.session.commit()
+        
+        response = client.get('/api/v1/users/bulk/lost-job')
+        
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'failed'
+        assert client.get('/api/v1/users/bulk/missing').status_code == 404
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])